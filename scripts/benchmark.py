@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for the ingest and export pipeline.
+
+Generates (or reuses) a synthetic corpus with generate_corpus.py, then runs
+each pipeline stage as its own process against a fresh database:
+
+    mbox     mbox_contact_summary.py corpus.mbox
+    vcf      mbox_contact_summary.py --vcf contacts.vcf
+    csv      mbox_contact_summary.py --csv contacts.csv
+    export   process_db.py
+
+For every stage it records wall time, input records/sec, database rows/sec,
+the stage process's peak RSS and the database size afterwards. Results are
+written as JSON so runs can be compared over time with --compare.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from generate_corpus import generate_corpus
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Table whose row count each stage grows; export rows are counted in its CSV
+STAGE_TABLES = {
+    "mbox": "mbox_occurrences",
+    "vcf": "vcf_contacts",
+    "csv": "vcf_contacts",
+}
+
+
+def table_rows(db_path, table):
+    if not os.path.exists(db_path):
+        return 0
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        conn.close()
+
+
+def run_stage(cmd, log):
+    """
+    Run `cmd` to completion and return (seconds, peak RSS in MB).
+    """
+    log.write(f"$ {' '.join(cmd)}\n")
+    log.flush()
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=SCRIPTS_DIR)
+    _, status, usage = os.wait4(proc.pid, 0)
+    seconds = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise SystemExit(f"Stage failed with exit code {proc.returncode}: {' '.join(cmd)} (see {log.name})")
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = usage.ru_maxrss / (1024 * 1024) if sys.platform == "darwin" else usage.ru_maxrss / 1024
+    return seconds, peak
+
+
+def stage_commands(corpus_dir, db_path, export_path, workers):
+    script = os.path.join(SCRIPTS_DIR, "mbox_contact_summary.py")
+    mbox = [sys.executable, script, os.path.join(corpus_dir, "corpus.mbox"), "--output", db_path]
+    if workers > 1:
+        mbox += ["--workers", str(workers)]
+    return [
+        ("mbox", mbox),
+        ("vcf", [sys.executable, script, "--vcf", os.path.join(corpus_dir, "contacts.vcf"), "--output", db_path]),
+        ("csv", [sys.executable, script, "--csv", os.path.join(corpus_dir, "contacts.csv"), "--output", db_path]),
+        ("export", [sys.executable, os.path.join(SCRIPTS_DIR, "process_db.py"), "--db", db_path, "--output", export_path]),
+    ]
+
+
+def run_benchmark(corpus_dir, work_dir, workers=1):
+    with open(os.path.join(corpus_dir, "corpus.json"), encoding="utf-8") as f:
+        corpus = json.load(f)
+    inputs = {
+        "mbox": corpus["mbox_messages"],
+        "vcf": corpus["vcf_cards"],
+        "csv": corpus["csv_rows"],
+    }
+
+    db_path = os.path.abspath(os.path.join(work_dir, "benchmark.db"))
+    export_path = os.path.abspath(os.path.join(work_dir, "export.csv"))
+    for path in (db_path, db_path + "-wal", db_path + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+    stages = {}
+    with open(os.path.join(work_dir, "benchmark.log"), "w", encoding="utf-8") as log:
+        for name, cmd in stage_commands(os.path.abspath(corpus_dir), db_path, export_path, workers):
+            before = table_rows(db_path, STAGE_TABLES[name]) if name in STAGE_TABLES else 0
+            seconds, peak = run_stage(cmd, log)
+            if name == "export":
+                with open(export_path, encoding="utf-8") as f:
+                    rows = sum(1 for _ in f) - 1
+                records = rows
+            else:
+                rows = table_rows(db_path, STAGE_TABLES[name]) - before
+                records = inputs[name]
+            stages[name] = {
+                "seconds": round(seconds, 3),
+                "records": records,
+                "records_per_sec": round(records / seconds, 1),
+                "rows": rows,
+                "rows_per_sec": round(rows / seconds, 1),
+                "peak_rss_mb": round(peak, 1),
+                "db_size_mb": round(os.path.getsize(db_path) / (1024 * 1024), 2),
+            }
+    return {"corpus": corpus, "workers": workers, "stages": stages}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPTS_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_stages(stages):
+    print(f"{'stage':<8} {'seconds':>9} {'records/s':>11} {'rows/s':>11} {'peak MB':>9} {'db MB':>8}")
+    for name, s in stages.items():
+        print(f"{name:<8} {s['seconds']:>9.2f} {s['records_per_sec']:>11.0f} {s['rows_per_sec']:>11.0f} "
+              f"{s['peak_rss_mb']:>9.1f} {s['db_size_mb']:>8.1f}")
+
+
+def print_comparison(old, new):
+    print(f"\nCompared with {old.get('commit') or '?'} ({old.get('timestamp', '?')}):")
+    if old["corpus"]["spec"] != new["corpus"]["spec"]:
+        print("  warning: the corpora differ, rates are not directly comparable")
+    print(f"{'stage':<8} {'metric':<14} {'before':>10} {'after':>10} {'change':>8}")
+    for name, s in new["stages"].items():
+        before = old["stages"].get(name)
+        if not before:
+            continue
+        for metric in ("seconds", "records_per_sec", "peak_rss_mb", "db_size_mb"):
+            a, b = before[metric], s[metric]
+            change = f"{(b - a) / a * 100:+.1f}%" if a else ""
+            print(f"{name:<8} {metric:<14} {a:>10} {b:>10} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark each pipeline stage on a synthetic corpus.")
+    parser.add_argument("--corpus-dir", default=None, help="Use an existing generate_corpus.py output instead of generating one")
+    parser.add_argument("--work-dir", default="benchmark_work", help="Directory for the generated corpus, database and export (default: benchmark_work)")
+    parser.add_argument("--results-dir", default="benchmark_results", help="Directory to write the JSON result to (default: benchmark_results)")
+    parser.add_argument("--compare", default=None, help="Earlier result JSON to compare against")
+    parser.add_argument("--workers", type=int, default=1, help="--workers passed to the MBOX ingest stage (default: 1)")
+    parser.add_argument("--messages", type=int, default=10000, help="Messages to generate (default: 10000)")
+    parser.add_argument("--fanout", type=int, default=5, help="Maximum recipients per message (default: 5)")
+    parser.add_argument("--attachment-bytes", type=int, default=0, help="Attachment size (default: 0)")
+    parser.add_argument("--listserv-ratio", type=float, default=0.3, help="Fraction of mailing-list messages (default: 0.3)")
+    parser.add_argument("--duplicate-rate", type=float, default=0.05, help="Fraction of duplicate messages (default: 0.05)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    corpus_dir = args.corpus_dir
+    if corpus_dir is None:
+        corpus_dir = os.path.join(args.work_dir, "corpus")
+        spec = {
+            "messages": args.messages,
+            "fanout": args.fanout,
+            "attachment_bytes": args.attachment_bytes,
+            "listserv_ratio": args.listserv_ratio,
+            "duplicate_rate": args.duplicate_rate,
+            "seed": args.seed,
+        }
+        # Reuse the corpus from an earlier run with the same parameters
+        existing = os.path.join(corpus_dir, "corpus.json")
+        reuse = False
+        if os.path.exists(existing):
+            with open(existing, encoding="utf-8") as f:
+                old_spec = json.load(f)["spec"]
+            reuse = all(old_spec.get(k) == v for k, v in spec.items())
+        if not reuse:
+            print(f"Generating {args.messages} messages in {corpus_dir}")
+            generate_corpus(corpus_dir, **spec)
+
+    result = run_benchmark(corpus_dir, args.work_dir, workers=args.workers)
+    result.update({
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    })
+
+    print_stages(result["stages"])
+    os.makedirs(args.results_dir, exist_ok=True)
+    result_path = os.path.join(args.results_dir, f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results saved to {result_path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(json.load(f), result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the command-line scripts.
+
+The scripts are run thousands of times from cron and wrapper tools, mostly
+for a summary or a small export, so what they import before doing any work
+matters. For every script in BUDGETS this runs `python <script> --help` in
+fresh processes, takes the median wall time less that of a bare interpreter
+(`python -c pass`), and checks it against the script's budget. It also
+checks that the script does not import any of its forbidden modules:
+
+    script                   budget   must not import
+    db_summary.py             100 ms  sqlalchemy, pandas, numpy, pyarrow
+    process_db.py             100 ms  sqlalchemy, pandas, numpy, pyarrow
+    search_contacts.py        100 ms  sqlalchemy, pandas, numpy, pyarrow
+    format_email_list.py       50 ms  sqlalchemy, pandas, numpy, pyarrow
+    recategorize.py           900 ms  pandas, numpy, pyarrow
+    mbox_contact_summary.py  1200 ms  pandas, numpy, pyarrow
+
+db_summary.py, process_db.py and search_contacts.py read the database over
+plain sqlite3 (see contacts_core.py); SQLAlchemy is only imported to create
+or migrate a database, pandas only for CSV contact files and
+categorization, and numpy only for those and the ingest's interaction
+tracking. The budgets leave headroom over the times measured on the
+reference machine (README.md), so a script that exceeds one has picked up a
+heavy import. Exits with status 1 if any budget is exceeded; --importtime
+lists the slowest imports of each script to find the culprit.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LIGHT = ("sqlalchemy", "pandas", "numpy", "pyarrow")
+
+# script: (budget in ms over the bare interpreter, modules it must not import)
+BUDGETS = {
+    "db_summary.py": (100, LIGHT),
+    "process_db.py": (100, LIGHT),
+    "search_contacts.py": (100, LIGHT),
+    "format_email_list.py": (50, LIGHT),
+    "recategorize.py": (900, ("pandas", "numpy", "pyarrow")),
+    "mbox_contact_summary.py": (1200, ("pandas", "numpy", "pyarrow")),
+}
+
+DEFAULT_RUNS = 10
+
+
+def median_ms(cmd, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=SCRIPTS_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def imported(script, modules):
+    """
+    Which of `modules` importing `script` (as a module, without running its
+    main) loads.
+    """
+    module = os.path.splitext(script)[0]
+    code = f"import sys, {module}; print(' '.join(m for m in {modules!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def slowest_imports(script, top):
+    """
+    The `top` modules imported by `script` itself with the largest
+    cumulative time (their own imports included) under -X importtime, as
+    (ms, module).
+    """
+    module = os.path.splitext(script)[0]
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # -X importtime indents each level by two spaces; the script is at
+        # the top level, so its own imports are one level in
+        if len(name) - len(name.lstrip(" ")) != 3:
+            continue
+        entries.append((int(cumulative) / 1000, name.strip()))
+    return sorted(entries, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the startup time of each script against its import budget.")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help=f"Runs per script; the median is used (default: {DEFAULT_RUNS})")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N", help="Also list each script's N slowest imports")
+    args = parser.parse_args()
+
+    baseline = median_ms([sys.executable, "-c", "pass"], args.runs)
+    print(f"Interpreter startup: {baseline:.0f} ms (subtracted below)")
+    print(f"{'script':<26} {'startup':>9} {'budget':>8}  status")
+    failures = 0
+    for script, (budget, forbidden) in BUDGETS.items():
+        startup = median_ms([sys.executable, script, "--help"], args.runs) - baseline
+        loaded = imported(script, forbidden)
+        problems = []
+        if startup > budget:
+            problems.append("over budget")
+        if loaded:
+            problems.append(f"imports {', '.join(loaded)}")
+        failures += bool(problems)
+        print(f"{script:<26} {startup:>6.0f} ms {budget:>5} ms  {'; '.join(problems) or 'ok'}")
+        for ms, name in slowest_imports(script, args.importtime) if args.importtime else []:
+            print(f"    {ms:>8.1f} ms  {name}")
+
+    if failures:
+        print(f"{failures} script(s) over their startup budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
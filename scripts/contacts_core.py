@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Lightweight core shared by the contacts scripts: the occurrence marker bits,
+the address and message helpers, and `connect`, which opens a database on
+the plain sqlite3 driver.
+
+Only the standard library is imported here. The SQLAlchemy schema and the
+passes that create, migrate and maintain a database live in contacts_db.py,
+and pandas is only imported by the CSV contact ingest and the categorization
+pass, so scripts that just read a database (db_summary.py, process_db.py)
+start without either. benchmark_startup.py checks the import-time budget.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+
+# Occurrence markers, stored as bits of mbox_occurrences.marker_bits. A new
+# marker takes the next free bit; existing bits are stored in every database
+# and must never be renumbered.
+MARKER_BITS = {
+    "listserv": 1,
+    "automated": 2,
+    "direct": 4,
+}
+# Markers that get a partial index. "direct" is left out: it is on a large
+# share of occurrences, and contacts.direct_count already answers its queries.
+INDEXED_MARKERS = ("listserv", "automated")
+
+LISTSERV = MARKER_BITS["listserv"]
+AUTOMATED = MARKER_BITS["automated"]
+DIRECT = MARKER_BITS["direct"]
+
+# Version of the schema contacts_db.get_session creates, recorded in the
+# database's user_version once every migration has run. Bump it whenever a
+# table, column, index or migration is added, so that older databases are
+# taken through get_session (and its SQLAlchemy import) once.
+SCHEMA_VERSION = 5
+
+# Headers hashed to identify messages that have no Message-ID
+DIGEST_HEADERS = ["Date", "From", "To", "Cc", "Subject"]
+
+# Year of a stored message_date, as YearStats keys it
+MESSAGE_YEAR = "COALESCE(CAST(strftime('%Y', m.message_date) AS INTEGER), 0)"
+
+# Helper to guess name from email
+def name_from_email(email):
+    local_part = email.split("@")[0]
+    name_parts = re.split(r'[._\-]+', local_part)
+    return " ".join(part.capitalize() for part in name_parts if part.isalpha())
+
+# Helper to get the (lower-case) domain of an email address
+def email_domain(email):
+    return email.split('@')[-1].lower()
+
+# ...and the part before the @
+def email_local_part(email):
+    return email.split('@')[0]
+
+# Helper to parse a name string into first, last, and full name
+def parse_name(raw_name, email):
+    if raw_name and raw_name.strip():
+        name = raw_name.strip()
+        parts = name.split()
+        if len(parts) >= 2:
+            return parts[0], " ".join(parts[1:]), name
+        else:
+            return parts[0], "", name
+    else:
+        fallback = name_from_email(email)
+        return "", "", fallback
+
+# Bitmask for a comma-separated marker list (the format markers were stored
+# in before marker_bits). Names not in MARKER_BITS are ignored.
+def markers_to_bits(markers):
+    bits = 0
+    for name in (markers or "").split(","):
+        bits |= MARKER_BITS.get(name.strip(), 0)
+    return bits
+
+# SQL condition matching occurrences that carry marker `name`. The partial
+# indexes on mbox_occurrences are declared with this exact expression, and
+# SQLite only uses a partial index when the query repeats its WHERE term, so
+# marker filters should always be built here.
+def marker_expression(name):
+    return f"marker_bits & {MARKER_BITS[name]}"
+
+# Identify a message for de-duplication: a 64-bit hash of its Message-ID, or,
+# for messages without one, of its whitespace-normalized Date/From/To/Cc/Subject
+def message_digest(header_message_id, msg):
+    if header_message_id:
+        key = "id:" + header_message_id.strip().strip("<>").strip()
+    else:
+        values = []
+        for name in DIGEST_HEADERS:
+            value = msg.get(name) if msg is not None else None
+            values.append(" ".join(str(value).split()).lower() if value else "")
+        key = "hdr:" + "\n".join(values)
+    digest = hashlib.blake2b(key.encode("utf-8", "surrogateescape"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+# SQL functions used by the aggregate queries and migrations
+def register_functions(dbapi_connection, connection_record=None):
+    dbapi_connection.create_function("email_domain", 1, email_domain, deterministic=True)
+    dbapi_connection.create_function("email_local_part", 1, email_local_part, deterministic=True)
+    dbapi_connection.create_function("markers_to_bits", 1, markers_to_bits, deterministic=True)
+
+# Open the existing database at `db_path` on the sqlite3 driver, with the SQL
+# functions registered. A database written by an older version (user_version
+# below SCHEMA_VERSION; 0 for one from before versioning) is first brought
+# up to date by contacts_db.get_session; only then is SQLAlchemy imported.
+# A database an ingest is loading is read as it is, without the indexes the
+# load has dropped. Raises FileNotFoundError for a missing database rather
+# than creating an empty one, and ValueError for one written by a newer
+# version.
+def connect(db_path):
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError(f"No such database: {db_path}")
+    connection = sqlite3.connect(db_path)
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    if version > SCHEMA_VERSION:
+        connection.close()
+        raise ValueError(f"{db_path} has schema version {version}, newer than this version of the scripts ({SCHEMA_VERSION})")
+    if version < SCHEMA_VERSION:
+        connection.close()
+        from contacts_db import get_session
+        get_session(db_path).close()
+        connection = sqlite3.connect(db_path)
+    register_functions(connection)
+    return connection
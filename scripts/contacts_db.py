@@ -0,0 +1,751 @@
+#!/usr/bin/env python3
+"""
+SQLAlchemy schema of the contacts database, and the passes that create,
+migrate and maintain it: `get_session`, the contacts and year_stats
+aggregates, interactions, merging databases, the owner's direct contacts
+and categorization.
+Scripts that only read a database open it with contacts_core.connect
+instead and never import this module (or SQLAlchemy) once the schema is
+current.
+"""
+import json
+import os
+import sqlite3
+import sys
+from collections import Counter
+from contextlib import closing
+
+# SQLAlchemy imports for database operations
+from sqlalchemy import create_engine, event, inspect, select, text, Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, String, Text
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from contacts_core import (AUTOMATED, DIRECT, INDEXED_MARKERS, LISTSERV, MESSAGE_YEAR, SCHEMA_VERSION,
+                           marker_expression, message_digest, register_functions)
+from rules import Rules, rules_from_overrides
+
+# Contacts categorized per pass by recategorize()
+RECATEGORIZE_CHUNK = 100000
+
+# marker_expression as a clause for SQLAlchemy queries and index definitions
+def marker_condition(name):
+    return text(marker_expression(name))
+
+# Setup SQLAlchemy database
+Base = declarative_base()
+
+# Each distinct email address is stored once and referenced by integer id
+class Address(Base):
+    __tablename__ = 'addresses'
+
+    id = Column(Integer, primary_key=True)
+    email = Column(String, nullable=False, unique=True)
+
+# Distinct lists of header names (e.g. "from,to,subject,list-unsubscribe").
+# Most messages share a few dozen header layouts, so they are interned here.
+class HeaderSet(Base):
+    __tablename__ = 'header_sets'
+
+    id = Column(Integer, primary_key=True)
+    headers = Column(Text, nullable=False, unique=True)
+
+# Ingestion ledger: one row per input file (mbox, vcf or csv). `checkpoint`
+# is the byte offset up to which the file's data has been committed, so an
+# interrupted or appended-to file can be picked up where it left off, and
+# `size`/`mtime`/`fingerprint` tell whether the file changed since.
+class IngestedFile(Base):
+    __tablename__ = 'ingested_files'
+
+    id = Column(Integer, primary_key=True)
+    path = Column(String, nullable=False, unique=True)
+    kind = Column(String, nullable=False)  # "mbox", "vcf" or "csv"
+    size = Column(Integer, nullable=True)
+    mtime = Column(Float, nullable=True)
+    fingerprint = Column(String, nullable=True)
+    checkpoint = Column(Integer, nullable=False, default=0)
+    completed = Column(Boolean, nullable=False, default=False)
+
+# One row per ingested message; the occurrences of its addresses point here
+class Message(Base):
+    __tablename__ = 'messages'
+
+    id = Column(Integer, primary_key=True)
+    source_id = Column(Integer, ForeignKey('ingested_files.id'), nullable=True)
+    # 64-bit hash of the Message-ID (or of the main headers when there is
+    # none). The index on it is the seen-set used to drop duplicate messages.
+    digest = Column(Integer, index=True, nullable=True)
+    header_message_id = Column(String, nullable=True)  # value of the Message-ID header
+    message_date = Column(DateTime, nullable=True)
+    header_set_id = Column(Integer, ForeignKey('header_sets.id'), nullable=False)
+    is_listserv = Column(Boolean, nullable=False, default=False)
+
+class MboxOccurrence(Base):
+    __tablename__ = 'mbox_occurrences'
+    
+    id = Column(Integer, primary_key=True)
+    # Indexed for the per-message joins and deletes: interactions, purging a
+    # rewritten file, merging
+    message_id = Column(Integer, ForeignKey('messages.id'), index=True, nullable=False)
+    address_id = Column(Integer, ForeignKey('addresses.id'), index=True, nullable=False)
+    first_name = Column(String, nullable=True)
+    last_name = Column(String, nullable=True)
+    name = Column(String, nullable=True)  # fallback if first/last not parsed
+    header_context = Column(String, nullable=False)  # e.g., "From" or "To"
+    marker_bits = Column(Integer, nullable=False, server_default=text("0"))  # MARKER_BITS flags
+
+    # A small partial index per indexed marker, so marker counts and
+    # per-address marker lookups only touch the occurrences that carry it
+    __table_args__ = tuple(
+        Index(f"ix_mbox_occurrences_{name}", "address_id", sqlite_where=marker_condition(name))
+        for name in INDEXED_MARKERS
+    )
+
+# Per-address summary maintained incrementally as batches are ingested, so
+# exports don't have to re-aggregate mbox_occurrences. `name` is the name
+# seen on the earliest dated occurrence; `direct_count` and `listserv_count`
+# are the numbers of occurrences carrying the "direct" and "listserv" markers.
+# `category` is set by recategorize() from these columns and the rules.
+class Contact(Base):
+    __tablename__ = 'contacts'
+
+    address_id = Column(Integer, ForeignKey('addresses.id'), primary_key=True)
+    domain = Column(String, index=True, nullable=False)
+    name = Column(String, nullable=True)
+    occurrences = Column(Integer, index=True, nullable=False, default=0)
+    first_date = Column(DateTime, nullable=True)
+    last_date = Column(DateTime, index=True, nullable=True)
+    direct_count = Column(Integer, index=True, nullable=False, default=0)
+    listserv_count = Column(Integer, nullable=True)  # NULL until counted in databases that predate it
+    category = Column(String, index=True, nullable=True)
+
+# Message and occurrence counts per year of the message date (year 0 holds
+# undated messages), kept current by the bulk loader so db_summary.py never
+# has to scan mbox_occurrences. `automated` counts the occurrences carrying
+# the "automated" marker, which is fixed at ingest.
+class YearStats(Base):
+    __tablename__ = 'year_stats'
+
+    year = Column(Integer, primary_key=True, autoincrement=False)
+    messages = Column(Integer, nullable=False, default=0)
+    occurrences = Column(Integer, nullable=False, default=0)
+    automated = Column(Integer, nullable=False, default=0)
+
+# Who has written to whom: one row per distinct (sender, recipient) pair of
+# addresses seen in the From and To of the same message. The "direct" marker
+# is derived from this once the owner is known (see resolve_direct).
+class Interaction(Base):
+    __tablename__ = 'interactions'
+
+    sender_id = Column(Integer, ForeignKey('addresses.id'), primary_key=True)
+    recipient_id = Column(Integer, ForeignKey('addresses.id'), primary_key=True)
+
+    __table_args__ = (
+        Index("ix_interactions_recipient_id", "recipient_id", "sender_id"),
+        {"sqlite_with_rowid": False},
+    )
+
+# Indexes an ingest has dropped for its bulk load (see fast_load in
+# mbox_contact_summary.py) and not rebuilt yet. Rows left over after the
+# ingest has ended mean it was interrupted, and the next ingest rebuilds
+# them. Readers ignore the table: a database that is being loaded is read as
+# it is, only without those indexes.
+class DroppedIndex(Base):
+    __tablename__ = 'dropped_indexes'
+
+    name = Column(String, primary_key=True)
+
+# Settings kept with the data. "rules" holds the rules file keys (as JSON)
+# last applied by recategorize(), which later runs use unless given others.
+class Setting(Base):
+    __tablename__ = 'settings'
+
+    key = Column(String, primary_key=True)
+    value = Column(Text, nullable=False)
+
+class VCFContact(Base):
+    __tablename__ = 'vcf_contacts'
+    
+    id = Column(Integer, primary_key=True)
+    email = Column(String, index=True, nullable=False, unique=True)
+    first_name = Column(String, nullable=True)
+    last_name = Column(String, nullable=True)
+    name = Column(String, nullable=True)  # fallback if first/last not parsed
+
+# Open (creating or migrating as needed) the database at `db_path`. A
+# database already at SCHEMA_VERSION is opened as is; anything else goes
+# through every migration below, after which the version is recorded.
+# Migration progress goes to stderr, since readers such as db_summary.py
+# --json migrate an old database on open and own stdout.
+def get_session(db_path):
+    engine = create_engine(f'sqlite:///{db_path}')
+    event.listen(engine, "connect", register_functions)
+    Session = sessionmaker(bind=engine)
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA user_version").scalar() == SCHEMA_VERSION:
+            return Session()
+    legacy = has_legacy_schema(engine)
+    new_interactions = not inspect(engine).has_table(Interaction.__tablename__)
+    new_year_stats = not inspect(engine).has_table(YearStats.__tablename__)
+    new_search_index = not inspect(engine).has_table("search_index")
+    if legacy:
+        # Move the old table out of the way before creating the new schema
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ALTER TABLE mbox_occurrences RENAME TO mbox_occurrences_legacy")
+    Base.metadata.create_all(engine)
+    add_missing_columns(engine)
+    if migrate_marker_strings(engine):
+        print(f"Converted the markers in {db_path} to marker_bits", file=sys.stderr)
+    add_missing_indexes(engine)
+    backfill_digests(engine)
+    if legacy:
+        print(f"Migrating {db_path} to the normalized messages/addresses schema...", file=sys.stderr)
+        migrate_legacy_occurrences(engine)
+    if new_search_index:
+        with engine.begin() as conn:
+            for statement in SEARCH_INDEX_DDL:
+                conn.exec_driver_sql(statement)
+            index_contacts(conn)
+            index_vcf_contacts(conn)
+    session = Session()
+    # Databases written before the contacts table existed need it filled once
+    if session.query(Contact.address_id).first() is None and session.query(MboxOccurrence.id).first() is not None:
+        print(f"Building contact aggregates for {db_path}...", file=sys.stderr)
+        rebuild_aggregates(session)
+    elif new_year_stats and session.query(MboxOccurrence.id).first() is not None:
+        rebuild_year_stats(session)
+    # ...and databases that predate the interactions table need it filled,
+    # and "direct" recomputed against the owner, once
+    if new_interactions and session.query(MboxOccurrence.id).first() is not None:
+        print(f"Recording interactions for {db_path}...", file=sys.stderr)
+        rebuild_interactions(session)
+        resolve_direct(session)
+        recategorize(session)
+    session.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+    session.commit()
+    return session
+
+# Merge a per-address aggregate into an existing contacts row. The name is
+# the one seen on the earliest dated occurrence; SQLite's two-argument MIN/MAX
+# return NULL if either side is NULL, hence the COALESCEs.
+CONTACTS_COLUMNS = "address_id, domain, name, occurrences, first_date, last_date, direct_count, listserv_count"
+CONTACTS_MERGE = """
+    ON CONFLICT (address_id) DO UPDATE SET
+        name = CASE WHEN excluded.first_date IS NOT NULL
+                         AND (contacts.first_date IS NULL OR excluded.first_date < contacts.first_date)
+                    THEN excluded.name ELSE contacts.name END,
+        occurrences = contacts.occurrences + excluded.occurrences,
+        first_date = MIN(COALESCE(contacts.first_date, excluded.first_date),
+                         COALESCE(excluded.first_date, contacts.first_date)),
+        last_date = MAX(COALESCE(contacts.last_date, excluded.last_date),
+                        COALESCE(excluded.last_date, contacts.last_date)),
+        direct_count = contacts.direct_count + excluded.direct_count,
+        listserv_count = contacts.listserv_count + excluded.listserv_count
+"""
+
+# Aggregate the occurrences with an id above `after` (all of them by default)
+# per address and merge them into contacts. The name of each address is
+# picked with a window function (earliest dated occurrence, lowest id on
+# ties), which CONTACTS_MERGE then weighs against the stored one.
+def aggregate_contacts(conn, after=0):
+    conn.exec_driver_sql(f"""
+        WITH ranked AS (
+            SELECT o.address_id, o.name, o.marker_bits, m.message_date,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY o.address_id
+                       ORDER BY m.message_date IS NULL, m.message_date, o.id
+                   ) AS rn
+            FROM mbox_occurrences o
+            JOIN messages m ON m.id = o.message_id
+            WHERE o.id > ?
+        )
+        INSERT INTO contacts ({CONTACTS_COLUMNS})
+        SELECT r.address_id, email_domain(a.email),
+               MAX(CASE WHEN r.rn = 1 AND r.message_date IS NOT NULL THEN r.name END),
+               COUNT(*), MIN(r.message_date), MAX(r.message_date),
+               SUM((r.marker_bits & {DIRECT}) != 0), SUM((r.marker_bits & {LISTSERV}) != 0)
+        FROM ranked r
+        JOIN addresses a ON a.id = r.address_id
+        WHERE true
+        GROUP BY r.address_id
+        {CONTACTS_MERGE}
+    """, (after,))
+
+# Recompute the contacts table from scratch in one pass over mbox_occurrences
+# (and year_stats with it)
+def rebuild_aggregates(session):
+    session.execute(Contact.__table__.delete())
+    aggregate_contacts(session.connection())
+    index_contacts(session.connection())
+    rebuild_year_stats(session)
+
+YEAR_STATS_MERGE = """
+    ON CONFLICT (year) DO UPDATE SET
+        messages = year_stats.messages + excluded.messages,
+        occurrences = year_stats.occurrences + excluded.occurrences,
+        automated = year_stats.automated + excluded.automated
+"""
+
+# Add the messages with an id above `after_message` and the occurrences with
+# an id above `after_occurrence` to year_stats
+def aggregate_year_stats(conn, after_message=0, after_occurrence=0):
+    conn.exec_driver_sql(f"""
+        INSERT INTO year_stats (year, messages, occurrences, automated)
+        SELECT {MESSAGE_YEAR}, COUNT(*), 0, 0 FROM messages m WHERE m.id > ? GROUP BY 1
+        {YEAR_STATS_MERGE}
+    """, (after_message,))
+    conn.exec_driver_sql(f"""
+        INSERT INTO year_stats (year, messages, occurrences, automated)
+        SELECT {MESSAGE_YEAR}, 0, COUNT(*), SUM((o.marker_bits & {AUTOMATED}) != 0)
+        FROM mbox_occurrences o
+        JOIN messages m ON m.id = o.message_id
+        WHERE o.id > ?
+        GROUP BY 1
+        {YEAR_STATS_MERGE}
+    """, (after_occurrence,))
+
+def rebuild_year_stats(session):
+    session.execute(YearStats.__table__.delete())
+    aggregate_year_stats(session.connection())
+    session.commit()
+
+# Record the (sender, recipient) pairs of already stored messages in
+# interactions: all of them, only those from one source file, or only those
+# of the occurrences with an id above `after`
+def derive_interactions(session, source_id=None, after=None):
+    if source_id is not None:
+        where = "AND s.message_id IN (SELECT id FROM messages WHERE source_id = :source_id)"
+    elif after is not None:
+        where = "AND s.id > :after AND r.id > :after"
+    else:
+        where = ""
+    session.execute(text(f"""
+        INSERT OR IGNORE INTO interactions (sender_id, recipient_id)
+        SELECT DISTINCT s.address_id, r.address_id
+        FROM mbox_occurrences s
+        JOIN mbox_occurrences r ON r.message_id = s.message_id AND r.header_context = 'to'
+        WHERE s.header_context = 'from' {where}
+    """), {"source_id": source_id, "after": after})
+
+def rebuild_interactions(session):
+    session.execute(Interaction.__table__.delete())
+    derive_interactions(session)
+    session.commit()
+
+# Full-text index over the people in the database, for search_contacts.py:
+# one row per contact (rowid = address id) and one per vcf_contacts entry
+# (rowid = minus its id), holding the name, the local part of the email and
+# the domain. Words are matched by prefix, ignoring case and accents, with
+# prefix indexes for 2- and 3-character prefixes; bm25 ranks a match in the
+# name above one in the local part, above one in the domain. The ingest
+# updates the rows of the contacts and VCF/CSV entries it writes, in the
+# same transaction.
+SEARCH_INDEX_DDL = [
+    "CREATE VIRTUAL TABLE search_index USING fts5(name, local_part, domain, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    "INSERT INTO search_index (search_index, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')",
+]
+
+SEARCH_CONTACT_ROWS = """
+    SELECT c.address_id, c.name, email_local_part(a.email), c.domain
+    FROM contacts c JOIN addresses a ON a.id = c.address_id
+"""
+
+SEARCH_VCF_ROWS = """
+    SELECT -v.id, v.name, email_local_part(v.email), email_domain(v.email)
+    FROM vcf_contacts v
+"""
+
+# (Re)index the contacts with these address ids, or all of them. Only rows
+# that are new or whose name changed are rewritten, so indexing a batch of
+# addresses the index already has costs one lookup per address.
+def index_contacts(conn, address_ids=None):
+    if address_ids is None:
+        conn.exec_driver_sql("DELETE FROM search_index WHERE rowid > 0")
+        conn.exec_driver_sql(f"INSERT INTO search_index (rowid, name, local_part, domain) {SEARCH_CONTACT_ROWS}")
+        return
+    stale = conn.exec_driver_sql(
+        "SELECT c.address_id, s.rowid FROM contacts c LEFT JOIN search_index s ON s.rowid = c.address_id "
+        "WHERE c.address_id IN (SELECT value FROM json_each(?)) AND (s.rowid IS NULL OR s.name IS NOT c.name)",
+        (json.dumps(list(address_ids)),)).all()
+    if not stale:
+        return
+    indexed = [(address_id,) for address_id, rowid in stale if rowid is not None]
+    if indexed:
+        conn.exec_driver_sql("DELETE FROM search_index WHERE rowid = ?", indexed)
+    conn.exec_driver_sql(
+        f"INSERT INTO search_index (rowid, name, local_part, domain) {SEARCH_CONTACT_ROWS} "
+        "WHERE c.address_id IN (SELECT value FROM json_each(?))",
+        (json.dumps([address_id for address_id, _ in stale]),))
+
+# Likewise for the vcf_contacts entries with these emails, or all of them
+def index_vcf_contacts(conn, emails=None):
+    if emails is None:
+        conn.exec_driver_sql("DELETE FROM search_index WHERE rowid < 0")
+        conn.exec_driver_sql(f"INSERT INTO search_index (rowid, name, local_part, domain) {SEARCH_VCF_ROWS}")
+        return
+    emails = json.dumps(list(emails))
+    ids = [tuple(row) for row in conn.exec_driver_sql(
+        "SELECT -id FROM vcf_contacts WHERE email IN (SELECT value FROM json_each(?))", (emails,))]
+    if ids:
+        conn.exec_driver_sql("DELETE FROM search_index WHERE rowid = ?", ids)
+    conn.exec_driver_sql(
+        f"INSERT INTO search_index (rowid, name, local_part, domain) {SEARCH_VCF_ROWS} "
+        "WHERE v.email IN (SELECT value FROM json_each(?))", (emails,))
+
+# Merge another database of this schema into this one: a shard written by
+# the ingest's --sharded mode, or a database ingested on another machine. The
+# shard is ATTACHed and copied with INSERT ... SELECT. Addresses, header sets
+# and ledger entries are matched by value (email, header list, path); the
+# shard's messages and occurrences are renumbered after the existing ones, in
+# their own order. Messages already stored (same digest) are skipped unless
+# `dedup` is false. The summary tables are not copied but brought up to date
+# from the copied occurrences, the way the ingest updates them per batch
+# (contacts, year_stats, interactions, search_index). The shard's VCF/CSV
+# entries only fill in the names missing from the stored ones, since a
+# database does not record which of its entries came from a VCF file. So
+# merging shards in order gives the database ingesting their mail in order
+# would.
+# The "direct" marker depends on the owner of the whole database, so it is
+# cleared on the copied occurrences: run resolve_direct (and recategorize)
+# once all merges are done.
+# With `source_id`, the copied messages are attributed to that ledger entry
+# instead of the shard's own, and its checkpoint is moved to `checkpoint` in
+# the same transaction. Returns (messages, occurrences, duplicates) copied
+# and skipped.
+def merge_database(session, path, dedup=True, source_id=None, checkpoint=None):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No such database: {path}")
+    with closing(sqlite3.connect(path)) as shard:
+        version = shard.execute("PRAGMA user_version").fetchone()[0]
+    if version > SCHEMA_VERSION:
+        raise ValueError(f"{path} has schema version {version}, newer than this version of the scripts ({SCHEMA_VERSION})")
+    if version != SCHEMA_VERSION:
+        # Older databases are migrated first, as on any open
+        shard = get_session(path)
+        shard.close()
+        shard.get_bind().dispose()
+
+    # ATTACH is not allowed inside a transaction
+    session.commit()
+    conn = session.connection()
+    conn.exec_driver_sql("ATTACH DATABASE ? AS shard", (path,))
+    after_message = conn.exec_driver_sql("SELECT COALESCE(MAX(id), 0) FROM main.messages").scalar()
+    after_occurrence = conn.exec_driver_sql("SELECT COALESCE(MAX(id), 0) FROM main.mbox_occurrences").scalar()
+
+    # The shard's messages to copy, numbered in order
+    keep = ""
+    if dedup:
+        keep = ("WHERE NOT EXISTS (SELECT 1 FROM main.messages x WHERE x.digest = m.digest) "
+                "AND NOT EXISTS (SELECT 1 FROM shard.messages y WHERE y.digest = m.digest AND y.id < m.id)")
+    conn.exec_driver_sql("CREATE TEMP TABLE merge_messages (seq INTEGER PRIMARY KEY, shard_id INTEGER UNIQUE)")
+    conn.exec_driver_sql(f"INSERT INTO merge_messages (shard_id) SELECT m.id FROM shard.messages m {keep} ORDER BY m.id")
+    messages = conn.exec_driver_sql("SELECT COUNT(*) FROM merge_messages").scalar()
+    duplicates = conn.exec_driver_sql("SELECT COUNT(*) FROM shard.messages").scalar() - messages
+
+    conn.exec_driver_sql("""
+        INSERT INTO main.header_sets (headers)
+        SELECT h.headers FROM shard.header_sets h
+        WHERE h.id IN (SELECT m.header_set_id FROM shard.messages m JOIN merge_messages k ON k.shard_id = m.id)
+          AND h.headers NOT IN (SELECT headers FROM main.header_sets)
+        ORDER BY h.id
+    """)
+    conn.exec_driver_sql("""
+        CREATE TEMP TABLE merge_header_sets AS
+        SELECT s.id AS shard_id, h.id FROM shard.header_sets s JOIN main.header_sets h ON h.headers = s.headers
+    """)
+    conn.exec_driver_sql("""
+        INSERT INTO main.addresses (email)
+        SELECT a.email FROM shard.addresses a
+        WHERE a.id IN (SELECT o.address_id FROM shard.mbox_occurrences o JOIN merge_messages k ON k.shard_id = o.message_id)
+          AND a.email NOT IN (SELECT email FROM main.addresses)
+        ORDER BY a.id
+    """)
+    conn.exec_driver_sql("CREATE TEMP TABLE merge_addresses (shard_id INTEGER PRIMARY KEY, id INTEGER NOT NULL)")
+    conn.exec_driver_sql("""
+        INSERT INTO merge_addresses (shard_id, id)
+        SELECT s.id, a.id FROM shard.addresses s JOIN main.addresses a ON a.email = s.email
+    """)
+
+    if source_id is None:
+        # A path already in the ledger keeps whichever entry got further
+        conn.exec_driver_sql("""
+            INSERT INTO main.ingested_files (path, kind, size, mtime, fingerprint, checkpoint, completed)
+            SELECT path, kind, size, mtime, fingerprint, checkpoint, completed FROM shard.ingested_files WHERE true
+            ON CONFLICT (path) DO UPDATE SET
+                kind = excluded.kind, size = excluded.size, mtime = excluded.mtime,
+                fingerprint = excluded.fingerprint, checkpoint = excluded.checkpoint, completed = excluded.completed
+            WHERE excluded.checkpoint >= ingested_files.checkpoint
+        """)
+        source = "(SELECT f.id FROM shard.ingested_files s JOIN main.ingested_files f ON f.path = s.path WHERE s.id = m.source_id)"
+    else:
+        source = str(int(source_id))
+    conn.exec_driver_sql(f"""
+        INSERT INTO main.messages (id, source_id, digest, header_message_id, message_date, header_set_id, is_listserv)
+        SELECT ? + k.seq, {source}, m.digest, m.header_message_id, m.message_date, h.id, m.is_listserv
+        FROM merge_messages k
+        JOIN shard.messages m ON m.id = k.shard_id
+        JOIN merge_header_sets h ON h.shard_id = m.header_set_id
+        ORDER BY k.seq
+    """, (after_message,))
+    conn.exec_driver_sql(f"""
+        INSERT INTO main.mbox_occurrences (message_id, address_id, first_name, last_name, name, header_context, marker_bits)
+        SELECT ? + k.seq, a.id, o.first_name, o.last_name, o.name, o.header_context, o.marker_bits & ~{DIRECT}
+        FROM shard.mbox_occurrences o
+        JOIN merge_messages k ON k.shard_id = o.message_id
+        JOIN merge_addresses a ON a.shard_id = o.address_id
+        ORDER BY o.id
+    """, (after_message,))
+    occurrences = conn.exec_driver_sql("SELECT COUNT(*) FROM main.mbox_occurrences WHERE id > ?",
+                                       (after_occurrence,)).scalar()
+
+    aggregate_contacts(conn, after_occurrence)
+    aggregate_year_stats(conn, after_message, after_occurrence)
+    derive_interactions(session, after=after_occurrence)
+    index_contacts(conn, [address_id for address_id, in conn.exec_driver_sql(
+        "SELECT DISTINCT address_id FROM main.mbox_occurrences WHERE id > ?", (after_occurrence,))])
+
+    conn.exec_driver_sql("""
+        INSERT INTO main.vcf_contacts (email, first_name, last_name, name)
+        SELECT email, first_name, last_name, name FROM shard.vcf_contacts WHERE true ORDER BY id
+        ON CONFLICT (email) DO UPDATE SET
+            first_name = COALESCE(NULLIF(vcf_contacts.first_name, ''), excluded.first_name),
+            last_name = COALESCE(NULLIF(vcf_contacts.last_name, ''), excluded.last_name),
+            name = COALESCE(NULLIF(vcf_contacts.name, ''), excluded.name)
+    """)
+    index_vcf_contacts(conn, [email for email, in conn.exec_driver_sql("SELECT email FROM shard.vcf_contacts")])
+
+    if checkpoint is not None:
+        conn.exec_driver_sql("UPDATE ingested_files SET checkpoint = ? WHERE id = ?", (checkpoint, source_id))
+    for table in ("merge_messages", "merge_header_sets", "merge_addresses"):
+        conn.exec_driver_sql(f"DROP TABLE temp.{table}")
+    session.commit()
+    session.connection().exec_driver_sql("DETACH DATABASE shard")
+    return messages, occurrences, duplicates
+
+# Once all the mail is in, pick the owner -- the address with the most
+# occurrences in the whole database, not just in one file -- and give the
+# "direct" marker to the addresses that have both written to the owner and
+# been written to by the owner. Both halves are index lookups on
+# interactions. The owner can change as mail is added, so addresses that
+# lost the status have the marker cleared, and addresses that have it get it
+# on any occurrence still missing it; contacts.direct_count follows.
+# Returns (owner email, number of direct addresses).
+def resolve_direct(session):
+    conn = session.connection()
+    owner = conn.exec_driver_sql(
+        "SELECT c.address_id, a.email FROM contacts c JOIN addresses a ON a.id = c.address_id "
+        "ORDER BY c.occurrences DESC, c.address_id LIMIT 1").first()
+    conn.exec_driver_sql("CREATE TEMP TABLE direct_addresses (address_id INTEGER PRIMARY KEY)")
+    if owner is not None:
+        conn.exec_driver_sql(
+            "INSERT INTO direct_addresses (address_id) "
+            "SELECT recipient_id FROM interactions WHERE sender_id = ? "
+            "INTERSECT SELECT sender_id FROM interactions WHERE recipient_id = ?", (owner[0], owner[0]))
+
+    lost = "SELECT address_id FROM contacts WHERE direct_count > 0 AND address_id NOT IN direct_addresses"
+    conn.exec_driver_sql(f"UPDATE mbox_occurrences SET marker_bits = marker_bits & ~{DIRECT} WHERE address_id IN ({lost})")
+    conn.exec_driver_sql(f"UPDATE contacts SET direct_count = 0 WHERE address_id IN ({lost})")
+    # Direct addresses with every occurrence marked need no update
+    stale = ("SELECT c.address_id FROM contacts c JOIN direct_addresses d ON d.address_id = c.address_id "
+             "WHERE c.direct_count != c.occurrences")
+    conn.exec_driver_sql(f"UPDATE mbox_occurrences SET marker_bits = marker_bits | {DIRECT} "
+                         f"WHERE address_id IN ({stale}) AND (marker_bits & {DIRECT}) = 0")
+    conn.exec_driver_sql(f"UPDATE contacts SET direct_count = occurrences WHERE address_id IN ({stale})")
+
+    direct = conn.exec_driver_sql("SELECT COUNT(*) FROM direct_addresses").scalar()
+    conn.exec_driver_sql("DROP TABLE direct_addresses")
+    session.commit()
+    return (owner[1] if owner is not None else None), direct
+
+# The rules last applied to the database: the built-in rules with the stored
+# rules file keys, if any, in place of the defaults
+def stored_rules(session):
+    row = session.connection().exec_driver_sql("SELECT value FROM settings WHERE key = 'rules'").first()
+    return rules_from_overrides(json.loads(row[0]), "rules stored in the database") if row else Rules()
+
+# Re-derive listserv flags and contact categories from what is already stored,
+# under `rules` (the stored rules by default), without reading any mail:
+#  1. Each distinct header set is checked against the listserv headers once.
+#     Messages whose header set changed verdict, and the listserv bit of their
+#     occurrences, are updated.
+#  2. contacts.listserv_count is recounted (from the listserv partial index)
+#     if any flag changed or the database predates the column.
+#  3. The contacts are categorized with vectorized passes
+#     (Rules.categorize_frame) over chunks of RECATEGORIZE_CHUNK contacts,
+#     so memory stays flat, and only changed categories are written back.
+#  4. The rules file keys of `rules` are stored for stored_rules().
+# Returns ({category: contacts}, number of contacts whose category changed).
+def recategorize(session, rules=None):
+    # pandas is only needed here (and for CSV contact files), so it is not
+    # imported until a categorization actually runs
+    import pandas as pd
+
+    rules = rules or stored_rules(session)
+    conn = session.connection()
+
+    listserv_sets = {header_set_id: rules.is_listserv_message(headers)
+                     for header_set_id, headers in conn.exec_driver_sql("SELECT id, headers FROM header_sets")}
+    changed_sets = [(header_set_id, int(listserv_sets[header_set_id])) for header_set_id, is_listserv
+                    in conn.exec_driver_sql("SELECT DISTINCT header_set_id, is_listserv FROM messages")
+                    if bool(is_listserv) != listserv_sets[header_set_id]]
+    if changed_sets:
+        conn.exec_driver_sql("CREATE TEMP TABLE changed_header_sets (id INTEGER PRIMARY KEY, is_listserv INTEGER)")
+        conn.exec_driver_sql("INSERT INTO changed_header_sets (id, is_listserv) VALUES (?, ?)", changed_sets)
+        conn.exec_driver_sql(
+            "UPDATE messages SET is_listserv = c.is_listserv "
+            "FROM changed_header_sets c WHERE c.id = messages.header_set_id")
+        conn.exec_driver_sql(
+            f"UPDATE mbox_occurrences SET marker_bits = CASE WHEN m.is_listserv "
+            f"THEN marker_bits | {LISTSERV} ELSE marker_bits & ~{LISTSERV} END "
+            "FROM messages m JOIN changed_header_sets c ON c.id = m.header_set_id "
+            "WHERE m.id = mbox_occurrences.message_id")
+        conn.exec_driver_sql("DROP TABLE changed_header_sets")
+
+    if changed_sets or conn.exec_driver_sql("SELECT 1 FROM contacts WHERE listserv_count IS NULL LIMIT 1").first():
+        conn.exec_driver_sql(
+            "UPDATE contacts SET listserv_count = (SELECT COUNT(*) FROM mbox_occurrences o "
+            f"WHERE o.address_id = contacts.address_id AND marker_bits & {LISTSERV})")
+
+    counts = Counter()
+    changed_total = 0
+    last_id = 0
+    while True:
+        # Read straight off the sqlite3 connection; building a Row per
+        # contact would cost more than the categorization itself
+        frame = pd.read_sql_query(
+            "SELECT c.address_id, a.email, c.domain, c.occurrences, c.direct_count, c.listserv_count, c.category "
+            "FROM contacts c JOIN addresses a ON a.id = c.address_id "
+            "WHERE c.address_id > ? ORDER BY c.address_id LIMIT ?",
+            conn.connection.driver_connection, params=(last_id, RECATEGORIZE_CHUNK))
+        if frame.empty:
+            break
+        last_id = int(frame["address_id"].iloc[-1])
+        categories = rules.categorize_frame(frame)
+        changed = frame["category"].to_numpy() != categories
+        if changed.any():
+            conn.exec_driver_sql("UPDATE contacts SET category = ? WHERE address_id = ?",
+                                 list(zip(categories[changed].tolist(), frame["address_id"][changed].tolist())))
+        counts.update(categories.tolist())
+        changed_total += int(changed.sum())
+    conn.exec_driver_sql("INSERT INTO settings (key, value) VALUES ('rules', ?) "
+                         "ON CONFLICT (key) DO UPDATE SET value = excluded.value", (json.dumps(rules.overrides),))
+    session.commit()
+    return counts, changed_total
+
+# create_all only creates missing tables; add any nullable (or defaulted)
+# columns introduced since an existing database was created
+def add_missing_columns(engine):
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                if column.nullable:
+                    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+                elif column.server_default is not None:
+                    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type} "
+                                         f"NOT NULL DEFAULT {column.server_default.arg}")
+
+# Databases written before marker_bits kept markers as a comma-separated
+# string in mbox_occurrences.markers. Convert them (add_missing_columns has
+# already added marker_bits) and drop the old column. Returns whether there
+# was anything to convert.
+def migrate_marker_strings(engine):
+    with engine.begin() as conn:
+        columns = {column['name'] for column in inspect(conn).get_columns("mbox_occurrences")}
+        if "markers" not in columns:
+            return False
+        conn.exec_driver_sql("UPDATE mbox_occurrences SET marker_bits = markers_to_bits(markers) "
+                             "WHERE COALESCE(markers, '') != ''")
+        conn.exec_driver_sql("ALTER TABLE mbox_occurrences DROP COLUMN markers")
+    return True
+
+# Likewise for indexes added to tables that already exist
+def add_missing_indexes(engine):
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+# Messages stored before digests were recorded can still be recognized by
+# their Message-ID
+def backfill_digests(engine):
+    with engine.begin() as conn:
+        rows = conn.execute(select(Message.id, Message.header_message_id).where(
+            Message.digest.is_(None), Message.header_message_id.isnot(None))).all()
+        if rows:
+            conn.execute(text("UPDATE messages SET digest = :digest WHERE id = :id"),
+                         [{"id": message_id, "digest": message_digest(header_message_id, None)}
+                          for message_id, header_message_id in rows])
+
+# Databases created before the messages/addresses tables existed store the
+# email, date and raw header list on every mbox_occurrences row
+def has_legacy_schema(engine):
+    inspector = inspect(engine)
+    if not inspector.has_table('mbox_occurrences'):
+        return False
+    return 'email' in {column['name'] for column in inspector.get_columns('mbox_occurrences')}
+
+# Copy a legacy mbox_occurrences table (renamed to mbox_occurrences_legacy)
+# into the normalized schema. The legacy rows carry no message identity, so
+# messages are rebuilt from runs of consecutive rows: a new message starts
+# whenever the date or header list changes, or when a "from" row follows a
+# "to" row (each message wrote its From rows before its To rows). Everything
+# runs as INSERT ... SELECT so it stays fast on large databases.
+def migrate_legacy_occurrences(engine):
+    statements = [
+        """
+        CREATE TEMP TABLE legacy_messages AS
+        SELECT id, SUM(is_new) OVER (ORDER BY id) AS message_id
+        FROM (
+            SELECT id,
+                   CASE WHEN LAG(id) OVER w IS NULL
+                          OR occurrence_date IS NOT LAG(occurrence_date) OVER w
+                          OR raw_headers IS NOT LAG(raw_headers) OVER w
+                          OR (header_context = 'from' AND LAG(header_context) OVER w = 'to')
+                        THEN 1 ELSE 0 END AS is_new
+            FROM mbox_occurrences_legacy
+            WINDOW w AS (ORDER BY id)
+        )
+        """,
+        """
+        INSERT INTO header_sets (headers)
+        SELECT DISTINCT COALESCE(raw_headers, '') FROM mbox_occurrences_legacy
+        WHERE COALESCE(raw_headers, '') NOT IN (SELECT headers FROM header_sets)
+        """,
+        """
+        INSERT INTO addresses (email)
+        SELECT email FROM mbox_occurrences_legacy
+        WHERE email NOT IN (SELECT email FROM addresses)
+        GROUP BY email ORDER BY MIN(id)
+        """,
+        """
+        INSERT INTO messages (id, header_message_id, message_date, header_set_id, is_listserv)
+        SELECT g.message_id, NULL, MIN(l.occurrence_date), h.id,
+               MAX(INSTR(COALESCE(l.markers, ''), 'listserv') > 0)
+        FROM mbox_occurrences_legacy l
+        JOIN legacy_messages g ON g.id = l.id
+        JOIN header_sets h ON h.headers = COALESCE(l.raw_headers, '')
+        GROUP BY g.message_id
+        """,
+        """
+        INSERT INTO mbox_occurrences (id, message_id, address_id, first_name, last_name, name, header_context, marker_bits)
+        SELECT l.id, g.message_id, a.id, l.first_name, l.last_name, l.name, l.header_context, markers_to_bits(l.markers)
+        FROM mbox_occurrences_legacy l
+        JOIN legacy_messages g ON g.id = l.id
+        JOIN addresses a ON a.email = l.email
+        ORDER BY l.id
+        """,
+        "DROP TABLE legacy_messages",
+        "DROP TABLE mbox_occurrences_legacy",
+    ]
+    with engine.begin() as conn:
+        for statement in statements:
+            conn.exec_driver_sql(statement)
+    # Reclaim the space the duplicated header lists used to take
+    with engine.connect() as conn:
+        conn.exec_driver_sql("VACUUM")
+
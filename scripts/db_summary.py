@@ -1,63 +1,130 @@
 #!/usr/bin/env python3
 import argparse
-from sqlalchemy import create_engine, func
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, DateTime, Text
-
-# Define a base for our models
-Base = declarative_base()
-
-# Define the MboxOccurrence model matching our ingestion script
-class MboxOccurrence(Base):
-    __tablename__ = 'mbox_occurrences'
-    
-    id = Column(Integer, primary_key=True)
-    email = Column(String, index=True, nullable=False)
-    first_name = Column(String, nullable=True)
-    last_name = Column(String, nullable=True)
-    name = Column(String, nullable=True)  # fallback if first/last not parsed
-    header_context = Column(String, nullable=False)  # e.g., "From" or "To,CC"
-    occurrence_date = Column(DateTime, nullable=True)
-    markers = Column(String, nullable=True)  # e.g., "listserv,automated"
-    raw_headers = Column(Text, nullable=True)
+import heapq
+import json
+from datetime import datetime
+from contacts_core import connect, marker_expression
+
+# Domains listed in the summary by default (--top)
+DEFAULT_TOP_DOMAINS = 10
+
+
+# Build the summary from the tables the ingest keeps up to date, never from
+# mbox_occurrences itself:
+#  - one pass over contacts, grouped by (domain, category), gives the address
+#    and occurrence totals, the date range, the direct and listserv marker
+#    counts and the category and domain breakdowns;
+#  - year_stats (one row per year) gives message counts, the per-year
+#    breakdown and the automated marker count.
+# Only databases whose listserv counts predate contacts.listserv_count fall
+# back to counting the listserv partial index.
+def summarize(conn, top_domains=DEFAULT_TOP_DOMAINS):
+    summary = {
+        "addresses": 0,
+        "occurrences": 0,
+        "earliest": None,
+        "latest": None,
+        "markers": {"listserv": 0, "automated": 0, "direct": 0},
+    }
+    categories = {}
+    domains = {}
+    uncounted = False
+    rows = conn.execute("""
+        SELECT domain, category, COUNT(*), SUM(occurrences), MIN(first_date), MAX(last_date),
+               SUM(direct_count), SUM(listserv_count), COUNT(*) - COUNT(listserv_count)
+        FROM contacts
+        GROUP BY domain, category
+    """)
+    for domain, category, addresses, occurrences, earliest, latest, direct, listserv, missing in rows:
+        summary["addresses"] += addresses
+        summary["occurrences"] += occurrences
+        if earliest is not None and (summary["earliest"] is None or earliest < summary["earliest"]):
+            summary["earliest"] = earliest
+        if latest is not None and (summary["latest"] is None or latest > summary["latest"]):
+            summary["latest"] = latest
+        summary["markers"]["direct"] += direct
+        summary["markers"]["listserv"] += listserv or 0
+        uncounted = uncounted or missing > 0
+        for totals, key in ((categories, category or "uncategorized"), (domains, domain)):
+            entry = totals.setdefault(key, [0, 0])
+            entry[0] += addresses
+            entry[1] += occurrences
+
+    if uncounted:
+        summary["markers"]["listserv"] = conn.execute(
+            f"SELECT COUNT(*) FROM mbox_occurrences WHERE {marker_expression('listserv')}").fetchone()[0]
+    # Dates come back as the text SQLite stores
+    for key in ("earliest", "latest"):
+        if summary[key] is not None:
+            summary[key] = datetime.fromisoformat(summary[key])
+
+    years = {}
+    summary["messages"] = 0
+    for year, messages, occurrences, automated in conn.execute(
+            "SELECT year, messages, occurrences, automated FROM year_stats ORDER BY year"):
+        years[str(year) if year else "undated"] = {"messages": messages, "occurrences": occurrences}
+        summary["messages"] += messages
+        summary["markers"]["automated"] += automated
+
+    summary["categories"] = {category: {"addresses": addresses, "occurrences": occurrences}
+                             for category, (addresses, occurrences)
+                             in sorted(categories.items(), key=lambda item: -item[1][1])}
+    summary["domains"] = [{"domain": domain, "addresses": addresses, "occurrences": occurrences}
+                          for domain, (addresses, occurrences)
+                          in heapq.nlargest(top_domains, domains.items(), key=lambda item: item[1][1])]
+    summary["distinct_domains"] = len(domains)
+    summary["years"] = years
+    return summary
+
+
+def print_summary(db_path, summary):
+    markers = summary["markers"]
+    print("Database Summary")
+    print("----------------")
+    print(f"Database file: {db_path}")
+    print(f"Total Messages: {summary['messages']}")
+    print(f"Total MBOX Occurrences: {summary['occurrences']}")
+    print(f"Distinct Email Addresses: {summary['addresses']}")
+    print(f"Earliest Occurrence Date: {summary['earliest']}")
+    print(f"Latest Occurrence Date: {summary['latest']}")
+    print(f"Occurrences marked as listserv: {markers['listserv']}")
+    print(f"Occurrences marked as automated: {markers['automated']}")
+    print(f"Occurrences marked as direct: {markers['direct']}")
+
+    print("\nBy category:")
+    for category, totals in summary["categories"].items():
+        print(f"  {category:<16} {totals['addresses']:>10,} addresses {totals['occurrences']:>12,} occurrences")
+
+    print(f"\nTop domains (of {summary['distinct_domains']:,}):")
+    for totals in summary["domains"]:
+        print(f"  {totals['domain']:<32} {totals['addresses']:>10,} addresses {totals['occurrences']:>12,} occurrences")
+
+    print("\nBy year:")
+    for year, totals in summary["years"].items():
+        print(f"  {year:<8} {totals['messages']:>10,} messages {totals['occurrences']:>12,} occurrences")
+
 
 def main():
     parser = argparse.ArgumentParser(description="Summarize the contacts database.")
     parser.add_argument("db", nargs="?", default="contacts.db", help="SQLite database file (default: contacts.db)")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP_DOMAINS, help=f"Number of domains to list (default: {DEFAULT_TOP_DOMAINS})")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
     args = parser.parse_args()
-    
-    # Connect to the SQLite database using the provided filename
-    engine = create_engine(f"sqlite:///{args.db}")
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    
-    # Query total count of MBOX occurrences
-    total_occurrences = session.query(MboxOccurrence).count()
-    
-    # Count distinct email addresses captured
-    distinct_emails = session.query(MboxOccurrence.email).distinct().count()
-    
-    # Find the earliest and latest occurrence dates (if available)
-    min_date = session.query(func.min(MboxOccurrence.occurrence_date)).scalar()
-    max_date = session.query(func.max(MboxOccurrence.occurrence_date)).scalar()
-    
-    # Optionally, count occurrences marked with specific markers
-    listserv_count = session.query(MboxOccurrence).filter(MboxOccurrence.markers.like('%listserv%')).count()
-    automated_count = session.query(MboxOccurrence).filter(MboxOccurrence.markers.like('%automated%')).count()
-    
-    # Print a summary of the captured data
-    print("Database Summary")
-    print("----------------")
-    print(f"Database file: {args.db}")
-    print(f"Total MBOX Occurrences: {total_occurrences}")
-    print(f"Distinct Email Addresses: {distinct_emails}")
-    print(f"Earliest Occurrence Date: {min_date}")
-    print(f"Latest Occurrence Date: {max_date}")
-    print(f"Occurrences marked as listserv: {listserv_count}")
-    print(f"Occurrences marked as automated: {automated_count}")
-    
-    session.close()
+
+    # Connect to the SQLite database using the provided filename. This is a
+    # plain sqlite3 connection; older schemas (e.g. string markers) are
+    # migrated on the way, which is the only time SQLAlchemy is loaded.
+    try:
+        conn = connect(args.db)
+    except (FileNotFoundError, ValueError) as e:
+        parser.error(str(e))
+    summary = summarize(conn, args.top)
+    conn.close()
+
+    if args.json:
+        print(json.dumps({"database": args.db, **summary}, indent=2, default=datetime.isoformat))
+    else:
+        print_summary(args.db, summary)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Output formats for process_db.py.
+
+Every writer takes the export in batches of rows (tuples in EXPORT_COLUMNS
+order) and writes them as they come, so memory use is bounded by the batch
+size whatever the number of contacts:
+
+    csv      the original spreadsheet-friendly CSV (dates as text)
+    jsonl    one JSON object per contact (dates as ISO 8601 strings)
+    parquet  Parquet, one row group per batch
+    arrow    Arrow IPC file (Feather v2), one record batch per batch
+
+Parquet and Arrow keep the column types: counts are 64-bit integers and
+dates are timestamps. They need the pyarrow package, which is only
+imported when one of them is used.
+"""
+import csv
+import json
+
+# (column name, type) of the contact export; the types are pyarrow type
+# factory names
+EXPORT_COLUMNS = [
+    ("Email", "string"),
+    ("Name", "string"),
+    ("Occurrences", "int64"),
+    ("First Occurrence", "timestamp"),
+    ("Last Occurrence", "timestamp"),
+    ("Category", "string"),
+    ("Domain Frequency", "int64"),
+    ("Direct Count", "int64"),
+]
+
+FORMATS = ("csv", "jsonl", "parquet", "arrow")
+
+EXTENSIONS = {"csv": ".csv", "jsonl": ".jsonl", "parquet": ".parquet", "arrow": ".arrow"}
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401 (makes pyarrow.parquet available)
+    except ImportError:
+        raise ImportError("Writing Parquet or Arrow files requires the pyarrow package (pip install pyarrow)") from None
+    return pyarrow
+
+
+def arrow_schema(columns):
+    pa = import_pyarrow()
+    types = {"string": pa.string(), "int64": pa.int64(), "int32": pa.int32(), "bool": pa.bool_(),
+             "timestamp": pa.timestamp("us")}
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+class CsvWriter:
+    def __init__(self, path, columns=EXPORT_COLUMNS):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.dates = [i for i, (_, kind) in enumerate(columns) if kind == "timestamp"]
+        self.writer.writerow([name for name, _ in columns])
+
+    def write_batch(self, rows):
+        dates = self.dates
+        for row in rows:
+            row = ["" if value is None else value for value in row]
+            for i in dates:
+                if row[i]:
+                    row[i] = row[i].strftime(DATE_FORMAT)
+            self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlWriter:
+    def __init__(self, path, columns=EXPORT_COLUMNS):
+        self.file = open(path, "w", encoding="utf-8")
+        self.names = [name for name, _ in columns]
+        self.dates = [i for i, (_, kind) in enumerate(columns) if kind == "timestamp"]
+
+    def write_batch(self, rows):
+        dates = self.dates
+        lines = []
+        for row in rows:
+            row = list(row)
+            for i in dates:
+                if row[i] is not None:
+                    row[i] = row[i].isoformat()
+            lines.append(json.dumps(dict(zip(self.names, row)), ensure_ascii=False))
+        if lines:
+            self.file.write("\n".join(lines) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowWriter:
+    """
+    Parquet (`kind` "parquet") or Arrow IPC ("arrow") writer. Rows are
+    converted column by column into a RecordBatch with the writer's schema;
+    `write` also takes ready-made Arrow tables and batches.
+    """
+    def __init__(self, path, columns=EXPORT_COLUMNS, kind="parquet"):
+        pa = import_pyarrow()
+        self.pa = pa
+        self.schema = arrow_schema(columns)
+        if kind == "parquet":
+            self.writer = pa.parquet.ParquetWriter(path, self.schema, compression="zstd")
+        else:
+            self.sink = pa.OSFile(path, "wb")
+            self.writer = pa.ipc.new_file(self.sink, self.schema)
+        self.kind = kind
+
+    def batch(self, rows):
+        columns = list(zip(*rows)) if rows else [()] * len(self.schema)
+        return self.pa.RecordBatch.from_arrays(
+            [self.pa.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema)
+
+    def write_batch(self, rows):
+        if rows:
+            self.write(self.batch(rows))
+
+    def write(self, data):
+        self.writer.write(data)
+
+    def close(self):
+        self.writer.close()
+        if self.kind != "parquet":
+            self.sink.close()
+
+
+def open_writer(path, fmt, columns=EXPORT_COLUMNS):
+    if fmt == "csv":
+        return CsvWriter(path, columns)
+    if fmt == "jsonl":
+        return JsonlWriter(path, columns)
+    if fmt in ("parquet", "arrow"):
+        return ArrowWriter(path, columns, kind=fmt)
+    raise ValueError(f"Unknown export format: {fmt}")
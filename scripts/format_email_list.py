@@ -1,33 +1,149 @@
 #!/usr/bin/env python3
-import csv
 import argparse
+import csv
+import os
+
+# Rows fetched from the cursor at a time with --db
+FETCH_SIZE = 1000
+
+FORMATS = ("text", "vcf")
+
+
+# "Name <email>", or the bare address when there is no name
+def format_address(name, email):
+    return f"{name} <{email}>" if name else email
+
+
+# Escape a vCard text value (RFC 2426, section 4)
+def vcard_text(value):
+    value = value.replace("\r\n", "\n").replace("\r", "\n")
+    return value.replace("\\", "\\\\").replace(",", "\\,").replace(";", "\\;").replace("\n", "\\n")
+
+
+# A vCard 3.0 card for one address. N gets the name split the way the ingest
+# splits display names; without a name, FN is the address itself.
+def format_vcard(name, email):
+    parts = name.split()
+    first_name = parts[0] if parts else ""
+    last_name = " ".join(parts[1:])
+    return ("BEGIN:VCARD\r\n"
+            "VERSION:3.0\r\n"
+            f"N:{vcard_text(last_name)};{vcard_text(first_name)};;;\r\n"
+            f"FN:{vcard_text(name or email)}\r\n"
+            f"EMAIL;TYPE=INTERNET:{email}\r\n"
+            "END:VCARD\r\n")
+
+
+# (name, email) for each row of a process_db.py CSV export that has an email
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as csvfile:
+        for row in csv.DictReader(csvfile):
+            email = (row.get("Email") or "").strip()
+            if email:
+                yield (row.get("Name") or "").strip(), email
+
+
+# (name, email) for each contact process_db.py would export with these
+# filters, in the same (email) order, as the rows come off the cursor of the
+# connection `conn` (from contacts_core.connect). The database modules are
+# only imported for --db, so the CSV path stays as light as it was.
+def read_db(conn, db_path, fetch_size=FETCH_SIZE, **filters):
+    from process_db import categorize_if_needed, export_query
+    from run_stats import RunStats
+
+    try:
+        categorize_if_needed(conn, db_path, RunStats())
+        sql, params = export_query(**filters)
+        cursor = conn.execute(sql, params)
+        for rows in iter(lambda: cursor.fetchmany(fetch_size), []):
+            for email, name, *_ in rows:
+                yield (name or "").strip(), email.lower()
+    finally:
+        conn.close()
+
+
+# Writes the list to `path` as entries come in, or with `chunk_size` to
+# numbered files of at most that many entries each (list.txt becomes
+# list-001.txt, list-002.txt, ...). Text entries are joined with
+# `separator`; VCF cards follow one another. Only the file being written is
+# open, so memory use does not depend on the size of the list.
+class ListWriter:
+    def __init__(self, path, fmt="text", separator="\n", chunk_size=None):
+        self.path = path
+        self.format_entry = format_vcard if fmt == "vcf" else format_address
+        self.separator = "" if fmt == "vcf" else separator
+        # vCards keep the CRLF line ends they are written with
+        self.newline = "" if fmt == "vcf" else None
+        self.chunk_size = chunk_size
+        self.file = None
+        self.in_file = 0
+        self.entries = 0
+        self.paths = []
+        self._open()
+
+    def _open(self):
+        if self.file is not None:
+            self.file.close()
+        path = self.path
+        if self.chunk_size:
+            stem, ext = os.path.splitext(self.path)
+            path = f"{stem}-{len(self.paths) + 1:03d}{ext}"
+        self.file = open(path, "w", encoding="utf-8", newline=self.newline)
+        self.paths.append(path)
+        self.in_file = 0
+
+    def write(self, name, email):
+        if self.chunk_size and self.in_file == self.chunk_size:
+            self._open()
+        if self.in_file:
+            self.file.write(self.separator)
+        self.file.write(self.format_entry(name, email))
+        self.in_file += 1
+        self.entries += 1
+
+    def close(self):
+        self.file.close()
+
 
 def main():
-    parser = argparse.ArgumentParser(description="Format contacts CSV into an email list.")
-    parser.add_argument("--input", required=True, help="Path to the input CSV file with contacts")
+    parser = argparse.ArgumentParser(description="Format contacts into an email list or VCF file, from a CSV export or straight from the database.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="Path to the input CSV file with contacts (as written by process_db.py)")
+    source.add_argument("--db", help="SQLite database file to read the contacts from, filtered as by process_db.py")
     parser.add_argument("--output", required=True, help="Path to the output file for the email list")
+    parser.add_argument("--format", choices=FORMATS, default="text", help="text: one \"Name <email>\" entry per address (default); vcf: one vCard per address")
     parser.add_argument("--separator", type=str, default="\n",
                         help="Separator to use between email addresses (default: newline)")
+    parser.add_argument("--chunk-size", type=int, default=None, help="Write at most this many addresses per file, to numbered files next to --output (e.g. for mail-merge limits)")
+    parser.add_argument("--min-occurrences", type=int, default=0, help="With --db: drop contacts with Occurrences <= this threshold (e.g., 2)")
+    parser.add_argument("--recent-date", type=str, default=None, help="With --db: drop contacts where the most recent contact is older than this date (YYYY-MM-DD)")
+    parser.add_argument("--personal-only", action="store_true", help="With --db: only personal contacts")
+    parser.add_argument("--min-direct", type=int, default=0, help="With --db: drop contacts with Direct Count < this threshold (e.g., 2)")
     args = parser.parse_args()
+    if args.chunk_size is not None and args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
 
-    contacts = []
-    with open(args.input, newline="", encoding="utf-8") as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            email = row.get("Email", "").strip()
-            name = row.get("Name", "").strip()
-            if email:
-                if name:
-                    contacts.append(f"{name} <{email}>")
-                else:
-                    contacts.append(email)
-    
-    output_content = args.separator.join(contacts)
-    
-    with open(args.output, "w", encoding="utf-8") as outfile:
-        outfile.write(output_content)
-    
-    print(f"Email list written to {args.output}")
+    if args.db:
+        from contacts_core import connect
+        from process_db import parse_recent_date
+        try:
+            conn = connect(args.db)
+        except (FileNotFoundError, ValueError) as e:
+            parser.error(str(e))
+        contacts = read_db(conn, args.db, personal_only=args.personal_only, min_direct=args.min_direct,
+                           min_occurrences=args.min_occurrences, recent_date=parse_recent_date(args.recent_date))
+    else:
+        contacts = read_csv(args.input)
+
+    writer = ListWriter(args.output, args.format, args.separator, args.chunk_size)
+    for name, email in contacts:
+        writer.write(name, email)
+    writer.close()
+
+    if args.chunk_size:
+        print(f"{writer.entries} addresses written to {len(writer.paths)} files: {writer.paths[0]} .. {writer.paths[-1]}")
+    else:
+        print(f"Email list written to {args.output}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Deterministic synthetic corpus generator for benchmarking the ingest and
+export pipeline.
+
+Writes an MBOX archive (corpus.mbox) plus matching VCF and CSV contact files
+(contacts.vcf, contacts.csv) and a corpus.json describing them. Every message
+is derived from the seed and its own number alone, so the same arguments
+always produce byte-identical files, any size from a handful to millions of
+messages is written in constant memory, and a duplicate is simply an earlier
+message generated a second time (as in Gmail takeouts, where a message shows
+up once per label).
+"""
+import argparse
+import base64
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+FIRST_NAMES = [
+    "Alice", "Bob", "Carol", "David", "Eve", "Frank", "Grace", "Heidi", "Ivan", "Judy",
+    "Mallory", "Niaj", "Olivia", "Peggy", "Rupert", "Sybil", "Trent", "Victor", "Walter", "Zoë",
+]
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Müller", "Wilson",
+    "Anderson", "Taylor", "Thomas", "Moore", "Martin", "Lee", "O'Brien", "Clark", "Lewis", "Walker",
+]
+PERSONAL_DOMAINS = ["gmail.com", "yahoo.com", "hotmail.com", "outlook.com", "icloud.com", "comcast.net"]
+BUSINESS_DOMAINS = ["example.com", "corp.example", "widgets.io", "acme.co", "initech.com", "globex.net"]
+LIST_SENDERS = [
+    ("Weekly Digest", "digest@news.example.com"),
+    ("Neighborhood List", "neighbors@googlegroups.com"),
+    ("Book Club", "bookclub@yahoogroups.com"),
+    ("", "noreply@widgets.io"),
+    ("Notifications", "no-reply@acme.co"),
+    ("", "mailer-daemon@globex.net"),
+]
+SUBJECTS = [
+    "Lunch plans", "Project update", "Re: weekend", "Photos from the trip", "Quick question",
+    "Invoice attached", "Meeting notes", "Fwd: article", "Happy birthday!", "Weekly roundup",
+]
+
+# Random bytes the attachments are cut from, so large attachments cost a
+# slice rather than fresh random data per message
+ATTACHMENT_POOL_BYTES = 1024 * 1024
+
+OWNER_EMAIL = "owner@gmail.com"
+OWNER_NAME = "Pat Owner"
+
+DEFAULT_START = datetime(2015, 1, 1, tzinfo=timezone.utc)
+DEFAULT_YEARS = 10
+
+
+class Corpus:
+    """
+    Generates the messages and contacts of one synthetic corpus.
+    """
+    def __init__(self, messages, contacts=None, fanout=5, attachment_bytes=0, attachment_ratio=0.2,
+                 listserv_ratio=0.3, duplicate_rate=0.05, seed=1, years=DEFAULT_YEARS):
+        self.messages = messages
+        self.contact_count = contacts or min(max(100, messages // 10), 100000)
+        self.fanout = max(1, fanout)
+        self.attachment_bytes = attachment_bytes
+        self.attachment_ratio = attachment_ratio
+        self.listserv_ratio = listserv_ratio
+        self.duplicate_rate = duplicate_rate
+        self.seed = seed
+        self.years = years
+
+        rng = random.Random(seed)
+        self.contacts = [self._make_contact(rng, k) for k in range(self.contact_count)]
+        if attachment_bytes:
+            pool = base64.encodebytes(rng.randbytes(ATTACHMENT_POOL_BYTES * 3 // 4))
+            # Long enough to cut any attachment from any offset
+            self.attachment_pool = pool * (attachment_bytes // len(pool) + 2)
+        else:
+            self.attachment_pool = b""
+        self.step = timedelta(days=365 * years) / max(messages, 1)
+
+    def spec(self):
+        return {
+            "messages": self.messages,
+            "contacts": self.contact_count,
+            "fanout": self.fanout,
+            "attachment_bytes": self.attachment_bytes,
+            "attachment_ratio": self.attachment_ratio,
+            "listserv_ratio": self.listserv_ratio,
+            "duplicate_rate": self.duplicate_rate,
+            "seed": self.seed,
+            "years": self.years,
+        }
+
+    def _make_contact(self, rng, k):
+        first = rng.choice(FIRST_NAMES)
+        last = rng.choice(LAST_NAMES)
+        domains = PERSONAL_DOMAINS if rng.random() < 0.5 else BUSINESS_DOMAINS
+        local = f"{first}.{last}".lower().replace("'", "").replace("ö", "o").replace("ü", "u").replace("ë", "e")
+        email = f"{local}{k}@{rng.choice(domains)}"
+        # Some contacts only ever appear as a bare address
+        name = f"{first} {last}" if rng.random() < 0.8 else ""
+        return name, email
+
+    def _rng(self, i):
+        return random.Random(self.seed * 1000003 + i)
+
+    def _pick_contact(self, rng):
+        # Skewed towards the start of the pool: a few frequent correspondents
+        # and a long tail
+        return self.contacts[int(self.contact_count * rng.random() ** 3)]
+
+    def is_duplicate(self, i):
+        """
+        Return the number of the earlier message that message `i` repeats, or None.
+        """
+        rng = self._rng(i)
+        if i > 0 and rng.random() < self.duplicate_rate:
+            return rng.randrange(i)
+        return None
+
+    def message(self, i):
+        """
+        Return message `i` as bytes in mbox form (separator line included).
+        """
+        original = self.is_duplicate(i)
+        while original is not None:
+            i = original
+            original = self.is_duplicate(i)
+        rng = self._rng(i)
+        rng.random()  # the duplicate draw
+
+        date = DEFAULT_START + self.step * i + timedelta(seconds=rng.randrange(3600))
+        listserv = rng.random() < self.listserv_ratio
+        headers = []
+        if listserv:
+            sender = rng.choice(LIST_SENDERS)
+            recipients = [(OWNER_NAME, OWNER_EMAIL)]
+            headers.append(f"List-Unsubscribe: <mailto:unsubscribe@{sender[1].split('@')[1]}>")
+            headers.append("Precedence: bulk")
+        elif rng.random() < 0.5:
+            sender = (OWNER_NAME, OWNER_EMAIL)
+            recipients = [self._pick_contact(rng) for _ in range(rng.randint(1, self.fanout))]
+        else:
+            sender = self._pick_contact(rng)
+            recipients = [(OWNER_NAME, OWNER_EMAIL)]
+            recipients += [self._pick_contact(rng) for _ in range(rng.randint(0, self.fanout - 1))]
+
+        cc = []
+        if len(recipients) > 2 and rng.random() < 0.3:
+            cc = recipients[2:]
+            recipients = recipients[:2]
+
+        lines = [f"From {sender[1]} {date.strftime('%a %b %d %H:%M:%S %Y')}"]
+        lines.append(f"From: {format_address(sender)}")
+        lines.append("To: " + ", ".join(format_address(r) for r in recipients))
+        if cc:
+            lines.append("Cc: " + ", ".join(format_address(r) for r in cc))
+        lines.append(f"Subject: {rng.choice(SUBJECTS)}")
+        # A few messages have no usable date
+        if rng.random() < 0.995:
+            lines.append(f"Date: {format_datetime(date)}")
+        lines.append(f"Message-ID: <{i}.{self.seed}@synthetic.invalid>")
+        lines.append("MIME-Version: 1.0")
+        lines.extend(headers)
+
+        body = "Hi,\n\nJust following up on this.\n>From the last message: see below.\n\nThanks\n"
+        if self.attachment_bytes and rng.random() < self.attachment_ratio:
+            offset = rng.randrange(ATTACHMENT_POOL_BYTES // 2)
+            attachment = self.attachment_pool[offset:offset + self.attachment_bytes]
+            lines.append('Content-Type: multipart/mixed; boundary="b1"')
+            return ("\n".join(lines) + "\n\n--b1\nContent-Type: text/plain\n\n" + body +
+                    "--b1\nContent-Type: application/octet-stream\nContent-Transfer-Encoding: base64\n\n").encode() + \
+                attachment + b"\n--b1--\n\n"
+        lines.append("Content-Type: text/plain; charset=utf-8")
+        return ("\n".join(lines) + "\n\n" + body + "\n").encode()
+
+    def vcf_cards(self, ratio=0.2):
+        """
+        Yield vCards for a deterministic subset of the contacts. Some cards
+        carry a second email address.
+        """
+        rng = random.Random(self.seed + 1)
+        for name, email in self.contacts:
+            if rng.random() >= ratio:
+                continue
+            first, _, last = (name or "Unknown Person").partition(" ")
+            lines = ["BEGIN:VCARD", "VERSION:3.0", f"N:{last};{first};;;", f"FN:{name or first}"]
+            lines.append(f"EMAIL;TYPE=INTERNET:{email}")
+            if rng.random() < 0.2:
+                lines.append(f"EMAIL;TYPE=HOME:{email.split('@')[0]}@{rng.choice(PERSONAL_DOMAINS)}")
+            lines.append("TEL;TYPE=CELL:+1-555-0100")
+            lines.append("END:VCARD")
+            yield "\n".join(lines) + "\n"
+
+    def csv_rows(self, ratio=0.2):
+        """
+        Yield [Email, First, Last, Name] rows for a deterministic subset of
+        the contacts, with some fields left blank.
+        """
+        rng = random.Random(self.seed + 2)
+        for name, email in self.contacts:
+            if rng.random() >= ratio:
+                continue
+            first, _, last = name.partition(" ")
+            if rng.random() < 0.3:
+                name = ""
+            yield [email.upper() if rng.random() < 0.1 else email, first, last, name]
+
+
+def format_address(contact):
+    name, email = contact
+    return f'"{name}" <{email}>' if name else email
+
+
+def generate_corpus(output_dir, **spec):
+    """
+    Write corpus.mbox, contacts.vcf, contacts.csv and corpus.json into
+    `output_dir`. Keyword arguments are passed to Corpus. Returns the
+    contents of corpus.json.
+    """
+    import csv
+
+    os.makedirs(output_dir, exist_ok=True)
+    corpus = Corpus(**spec)
+
+    duplicates = 0
+    mbox_path = os.path.join(output_dir, "corpus.mbox")
+    with open(mbox_path, "wb", buffering=1024 * 1024) as f:
+        for i in range(corpus.messages):
+            if corpus.is_duplicate(i) is not None:
+                duplicates += 1
+            f.write(corpus.message(i))
+
+    cards = 0
+    with open(os.path.join(output_dir, "contacts.vcf"), "w", encoding="utf-8") as f:
+        for card in corpus.vcf_cards():
+            f.write(card)
+            cards += 1
+
+    csv_rows = 0
+    with open(os.path.join(output_dir, "contacts.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Email", "First", "Last", "Name"])
+        for row in corpus.csv_rows():
+            writer.writerow(row)
+            csv_rows += 1
+
+    summary = {
+        "spec": corpus.spec(),
+        "mbox_messages": corpus.messages,
+        "duplicate_messages": duplicates,
+        "mbox_bytes": os.path.getsize(mbox_path),
+        "vcf_cards": cards,
+        "csv_rows": csv_rows,
+    }
+    with open(os.path.join(output_dir, "corpus.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic MBOX/VCF/CSV corpus.")
+    parser.add_argument("--output-dir", default="corpus", help="Directory to write the corpus to (default: corpus)")
+    parser.add_argument("--messages", type=int, default=1000, help="Number of messages, duplicates included (default: 1000)")
+    parser.add_argument("--contacts", type=int, default=None, help="Size of the correspondent pool (default: messages/10, between 100 and 100000)")
+    parser.add_argument("--fanout", type=int, default=5, help="Maximum recipients per message (default: 5)")
+    parser.add_argument("--attachment-bytes", type=int, default=0, help="Size of the base64 attachment on messages that have one (default: 0, no attachments)")
+    parser.add_argument("--attachment-ratio", type=float, default=0.2, help="Fraction of messages with an attachment (default: 0.2)")
+    parser.add_argument("--listserv-ratio", type=float, default=0.3, help="Fraction of mailing-list/automated messages (default: 0.3)")
+    parser.add_argument("--duplicate-rate", type=float, default=0.05, help="Fraction of messages that repeat an earlier one (default: 0.05)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+    args = parser.parse_args()
+
+    summary = generate_corpus(
+        args.output_dir,
+        messages=args.messages,
+        contacts=args.contacts,
+        fanout=args.fanout,
+        attachment_bytes=args.attachment_bytes,
+        attachment_ratio=args.attachment_ratio,
+        listserv_ratio=args.listserv_ratio,
+        duplicate_rate=args.duplicate_rate,
+        seed=args.seed,
+    )
+    print(f"Wrote {summary['mbox_messages']} messages ({summary['mbox_bytes'] / 1e6:.1f} MB), "
+          f"{summary['vcf_cards']} vCards and {summary['csv_rows']} CSV rows to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
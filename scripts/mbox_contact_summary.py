@@ -1,205 +1,889 @@
 #!/usr/bin/env python3
 import argparse
-import mailbox
-import re
-import pandas as pd
-from email.utils import getaddresses, parsedate_to_datetime
-from datetime import datetime
-from collections import Counter
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from array import array
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, islice
+from operator import itemgetter
 
 # SQLAlchemy imports for database operations
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-
-# Define domains and patterns for categorization
-PERSONAL_DOMAINS = {
-    "gmail.com", "yahoo.com", "hotmail.com", "aol.com", "me.com", "icloud.com",
-    "comcast.net", "outlook.com", "msn.com", "live.com", "mac.com", 
-    "centurylink.net", "earthlink.net", "frontiernet.net", "drizzle.com",
-    "verizon.net", "yahoo.co.uk", "sbcglobal.net"
-}
-
-LISTSERV_HEADERS = [
-    "list-unsubscribe", "precedence", "x-mailer", "x-list"
-]
-
-AUTOMATION_KEYWORDS = ["noreply", "no-reply", "donotreply", "mailer-daemon"]
-
-# Helper to guess name from email
-def name_from_email(email):
-    local_part = email.split("@")[0]
-    name_parts = re.split(r'[._\-]+', local_part)
-    return " ".join(part.capitalize() for part in name_parts if part.isalpha())
-
-# Helper to parse a name string into first, last, and full name
-def parse_name(raw_name, email):
-    if raw_name and raw_name.strip():
-        name = raw_name.strip()
-        parts = name.split()
-        if len(parts) >= 2:
-            return parts[0], " ".join(parts[1:]), name
-        else:
-            return parts[0], "", name
+from sqlalchemy import func, select, text
+
+from contacts_core import AUTOMATED, DIRECT, LISTSERV, email_domain, message_digest, name_from_email
+from contacts_db import (CONTACTS_COLUMNS, CONTACTS_MERGE, YEAR_STATS_MERGE, Address, Contact, DroppedIndex,
+                         HeaderSet, IngestedFile, Interaction, MboxOccurrence, Message, derive_interactions,
+                         get_session, index_contacts, index_vcf_contacts, merge_database, rebuild_aggregates,
+                         rebuild_interactions, recategorize, resolve_direct, stored_rules)
+from mbox_scanner import (is_bundle, is_compressed, iter_bundle_members, iter_message_headers,
+                          iter_stream_headers, open_stream, parse_headers, plan_shards, read_ahead)
+from normalize import Normalizer, parse_date
+from rules import CATEGORIES, Rules, load_rules
+from run_stats import Progress, RunStats, profiled
+
+# The built-in categorization rules live in rules.py; RULES is what this run
+# uses (--rules, or the rules stored in the database; handed to worker processes)
+RULES = Rules()
+
+def use_rules(rules):
+    global RULES, NORMALIZER
+    RULES = rules
+    NORMALIZER = Normalizer(rules, STATS)
+
+# Size of the byte ranges a large mbox is split into for --workers
+SHARD_BYTES = 64 * 1024 * 1024
+
+# Number of occurrence rows written per INSERT batch
+DEFAULT_BATCH_SIZE = 5000
+
+# Upper bound on the email -> address id cache kept by the bulk loader
+ADDRESS_CACHE_SIZE = 200000
+
+# Memory (MB) the ingest's address cache and interaction tracker may use
+# together (--memory-budget); everything else it holds is bounded by the
+# batch size
+DEFAULT_MEMORY_BUDGET_MB = 128
+
+# Approximate size of one entry of the email -> address id cache
+ADDRESS_CACHE_ENTRY_BYTES = 160
+
+# (sender, recipient) pairs written per INSERT when the tracker spills
+SPILL_CHUNK = 50000
+
+# Maximum number of values bound into a single SQL IN (...) list
+SQL_IN_CHUNK = 500
+
+# Bytes hashed at each end of the ingested region when fingerprinting a file
+FINGERPRINT_BYTES = 64 * 1024
+
+# Messages per worker task when parsing a compressed stream with --workers
+STREAM_TASK_MESSAGES = 2000
+
+# Phase timers and counters for this process (see run_stats.py). Worker
+# processes have their own, which travel back with their results.
+STATS = RunStats()
+
+# Cached From/To and name normalization for this process (see normalize.py);
+# rebuilt by use_rules, since the automated flag depends on the rules
+NORMALIZER = Normalizer(RULES, STATS)
+
+# Whether ingest loops draw a progress line (--no-progress turns it off)
+SHOW_PROGRESS = True
+
+# Hash the head of a file plus the block ending at `length`. Comparing this
+# against the value recorded in the ledger tells whether the first `length`
+# bytes are still what was ingested (appending mail leaves them untouched)
+# without re-reading the whole file.
+def file_fingerprint(path, length):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(length).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(min(length, FINGERPRINT_BYTES)))
+        if length > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, length - FINGERPRINT_BYTES))
+            digest.update(f.read(length - f.tell()))
+    return digest.hexdigest()
+
+# Look an input file up in the ingestion ledger and decide where to start
+# reading it. Returns (entry, start_offset, previously_completed), with
+# start_offset None when the file is unchanged since it was last ingested.
+# MBOX files inside a tar/zip bundle are recorded as "<bundle>!<member>" and
+# identified by their archive entry (size, date and checksum). For compressed
+# inputs the checkpoint is an offset into the decompressed stream.
+def check_ledger(session, path, kind, member=None):
+    real_path = os.path.realpath(path)
+    if member is None:
+        stat = os.stat(real_path)
+        size, mtime = stat.st_size, stat.st_mtime
+        fingerprint = lambda length: file_fingerprint(real_path, length)
     else:
-        fallback = name_from_email(email)
-        return "", "", fallback
-
-def categorize_email(email, markers):
-    domain = email.split('@')[-1].lower()
-    marker_set = set(markers.split(',')) if markers else set()
-
-    if domain in PERSONAL_DOMAINS:
-        return 'personal'
-    elif 'direct' in marker_set and not marker_set.intersection({'listserv', 'unsubscribe'}):
-        return 'personal'
-    elif 'listserv' in marker_set or 'unsubscribe' in marker_set:
-        return 'listserv'
+        real_path = f"{real_path}!{member.name}"
+        size, mtime = member.size, member.mtime
+        fingerprint = lambda length: member.fingerprint
+    entry = session.query(IngestedFile).filter_by(path=real_path).first()
+
+    previously_completed = False
+    if entry is None:
+        entry = IngestedFile(path=real_path, kind=kind, checkpoint=0, completed=False)
+        session.add(entry)
+        start = 0
+    elif entry.completed and size == entry.size and mtime == entry.mtime:
+        return entry, None, True
+    elif entry.size is not None and size >= entry.size and fingerprint(entry.size) == entry.fingerprint:
+        if entry.completed and size == entry.size:
+            # Touched but not modified
+            entry.mtime = mtime
+            session.commit()
+            return entry, None, True
+        # Interrupted run, or mail appended since the last run
+        previously_completed = entry.completed
+        start = entry.checkpoint if kind == "mbox" else 0
     else:
-        return 'business'
+        # Rewritten or truncated: drop what was ingested from it before.
+        # Contact files are upserts, so they are simply read again.
+        if kind == "mbox":
+            purge_source(session, entry)
+        start = 0
 
-# Setup SQLAlchemy database
-Base = declarative_base()
+    entry.size = size
+    entry.mtime = mtime
+    entry.fingerprint = fingerprint(size)
+    entry.checkpoint = start
+    entry.completed = False
+    session.commit()
+    return entry, start, previously_completed
 
-class MboxOccurrence(Base):
-    __tablename__ = 'mbox_occurrences'
-    
-    id = Column(Integer, primary_key=True)
-    email = Column(String, index=True, nullable=False)
-    first_name = Column(String, nullable=True)
-    last_name = Column(String, nullable=True)
-    name = Column(String, nullable=True)  # fallback if first/last not parsed
-    header_context = Column(String, nullable=False)  # e.g., "From" or "To"
-    occurrence_date = Column(DateTime, nullable=True)
-    markers = Column(String, nullable=True)  # e.g., "listserv,automated"
-    raw_headers = Column(Text, nullable=True)
-
-class VCFContact(Base):
-    __tablename__ = 'vcf_contacts'
-    
-    id = Column(Integer, primary_key=True)
-    email = Column(String, index=True, nullable=False, unique=True)
-    first_name = Column(String, nullable=True)
-    last_name = Column(String, nullable=True)
-    name = Column(String, nullable=True)  # fallback if first/last not parsed
-
-def get_session(db_path):
-    engine = create_engine(f'sqlite:///{db_path}')
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    return Session()
-
-# Function to ingest an MBOX occurrence into the database
-def ingest_mbox_occurrence(email, first_name, last_name, full_name, header_context, occurrence_date, markers, raw_headers, session, occurrences_list):
-    occurrence = MboxOccurrence(
-        email=email,
-        first_name=first_name,
-        last_name=last_name,
-        name=full_name,
-        header_context=header_context,
-        occurrence_date=occurrence_date,
-        markers=markers,
-        raw_headers=raw_headers
-    )
-    occurrences_list.append(occurrence)
-    session.add(occurrence)
-
-# Process a single mbox file and insert occurrences into the database
-def process_mbox(mbox_path, args, session):
-    mbox = mailbox.mbox(mbox_path)
-    email_counter = Counter()
-    interactions = {}  # {(owner_email, candidate_email): {'owner_sent': bool, 'candidate_sent': bool}}
-
-    for msg in mbox:
-        headers = msg.keys()
-        msg_headers_lower = [h.lower() for h in headers]
-        date_header = msg.get("Date")
-        try:
-            msg_date = parsedate_to_datetime(date_header) if date_header else None
-            if msg_date and msg_date.tzinfo is not None:
-                msg_date = msg_date.astimezone(tz=None).replace(tzinfo=None)  # Convert to naive local time
-        except Exception:
-            msg_date = None
-
-        # Compute markers based on message headers
-        markers_list = []
-        for h in LISTSERV_HEADERS:
-            if h in msg_headers_lower:
-                markers_list.append("listserv")
-                break  # once found, no need to add multiple times
-        
-        # raw_headers: comma-separated list of header keys in lower-case
-        raw_headers_str = ",".join(msg_headers_lower)
-        
-        fields = ["From", "To"]
-        
-        for field in fields:
-            if field in msg:
-                addresses = getaddresses([msg[field]])
-                for raw_name, email in addresses:
-                    email = email.lower().strip()
-                    if not email or "@" not in email:
-                        continue
-                    
-                    # Count occurrences of each email for owner identification
-                    email_counter[email] += 1
-                    
-                    # Track interactions
-                    if email not in interactions:
-                        interactions[email] = {'owner_sent': False, 'candidate_sent': False}
-
-                    # If the message sender is the owner email, set 'owner_sent': True for all recipient emails
-                    if field == "From":
-                        interactions[email]['owner_sent'] = True
-                    # If the owner email is in recipients, set 'candidate_sent': True for the sender email
-                    elif field == "To":
-                        interactions[email]['candidate_sent'] = True
-
-                    # Compute additional markers based on email automation keywords
-                    if any(kw in email for kw in AUTOMATION_KEYWORDS):
-                        markers_list.append("automated")
-                    markers_str = ",".join(set(markers_list)) if markers_list else ""
-                    
-                    # Parse name
-                    first_name, last_name, full_name = parse_name(raw_name, email)
-                    
-                    # Use the current field as the header context
-                    header_context = field.lower()
-                    
-                    # Ingest occurrence
-                    ingest_mbox_occurrence(
-                        email=email,
-                        first_name=first_name,
-                        last_name=last_name,
-                        full_name=full_name,
-                        header_context=header_context,
-                        occurrence_date=msg_date,
-                        markers=markers_str,
-                        raw_headers=raw_headers_str,
-                        session=session,
-                        occurrences_list=[]
-                    )
-    
-    # Determine the owner's email (most common email)
-    owner_email = email_counter.most_common(1)[0][0] if email_counter else None
+# Remove the messages and occurrences previously ingested from a source file
+def purge_source(session, entry):
+    messages = select(Message.id).where(Message.source_id == entry.id)
+    session.execute(MboxOccurrence.__table__.delete().where(MboxOccurrence.message_id.in_(messages)))
+    session.execute(Message.__table__.delete().where(Message.source_id == entry.id))
+    rebuild_aggregates(session)
+    rebuild_interactions(session)
+
+# Mark a ledger entry as fully ingested. `checkpoint` is where reading would
+# resume if data is appended later; it defaults to the file size.
+def complete_source(session, entry, checkpoint=None):
+    entry.checkpoint = entry.size if checkpoint is None else checkpoint
+    entry.completed = True
+    session.commit()
+
+# Indexes dropped for the bulk load and built once after it
+LOAD_INDEXES = [*MboxOccurrence.__table__.indexes, *Contact.__table__.indexes, *Interaction.__table__.indexes]
 
-    # Add "direct" marker for bidirectional interactions
-    for email, interaction in interactions.items():
-        if interaction['owner_sent'] and interaction['candidate_sent']:
-            for occurrence in session.query(MboxOccurrence).filter_by(email=email).all():
-                occurrence.markers = (occurrence.markers + ",direct") if occurrence.markers else "direct"
+# Switch SQLite into a fast-load configuration for the duration of an ingest
+# run: WAL journal, relaxed fsync, and the mbox_occurrences, contacts and
+# interactions indexes built once after the data instead of maintained on every insert (then
+# ANALYZEd for the export queries). Afterwards the default
+# rollback journal is restored so the database is a single self-contained
+# file again (no -wal/-shm side files).
+# The dropped indexes are listed in dropped_indexes until they are back, so
+# a run that is killed mid-load leaves the next ingest to rebuild them. The
+# schema version is left alone: readers polling the database meanwhile
+# neither migrate it nor rebuild anything.
+@contextmanager
+def fast_load(session):
+    conn = session.connection()
+    conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+    conn.exec_driver_sql("PRAGMA synchronous=NORMAL")
+    conn.execute(DroppedIndex.__table__.insert().prefix_with("OR IGNORE"),
+                 [{"name": index.name} for index in LOAD_INDEXES])
+    for index in LOAD_INDEXES:
+        index.drop(conn, checkfirst=True)
+    try:
+        yield
+    except BaseException:
+        # Keep only what was committed with a checkpoint
+        session.rollback()
+        raise
+    finally:
+        with STATS.phase("index_build"):
+            rebuild_dropped_indexes(session)
+        # Leaving WAL needs the only open connection, so close any idle
+        # pooled ones first
+        session.get_bind().dispose()
+        session.connection().exec_driver_sql("PRAGMA journal_mode=DELETE")
+        session.commit()
 
+# Build the indexes listed in dropped_indexes -- by this run's fast_load, or
+# by an earlier one that was interrupted -- and clear the list
+def rebuild_dropped_indexes(session):
+    conn = session.connection()
+    dropped = {name for name, in conn.exec_driver_sql("SELECT name FROM dropped_indexes")}
+    if not dropped:
+        return
+    for index in LOAD_INDEXES:
+        if index.name in dropped:
+            index.create(conn, checkfirst=True)
+    # Let the planner weigh the export filters against the email order
+    conn.exec_driver_sql("ANALYZE contacts")
+    conn.exec_driver_sql("DELETE FROM dropped_indexes")
     session.commit()
 
+# Buffers extracted messages and writes them to messages/mbox_occurrences in
+# fixed-size batches with executemany-style Core inserts. Addresses and header
+# lists are interned into their own tables and referenced by id. No ORM
+# objects are created, so memory stays flat no matter how large the archive is.
+# Each batch is committed together with the source file's checkpoint, so an
+# interrupted run resumes right after the last committed batch. Messages that
+# are already in the database (same digest) are dropped before anything is
+# written for them. The sender/recipient pairs of the messages that are kept
+# go to `interactions` (an InteractionTracker), if given.
+# Time spent is charged to the dedup, db_insert, aggregate and commit phases;
+# `progress`, if given, is advanced to each message's end offset. With
+# `report`, what was written is counted in STATS and summed up when done.
+# With `summaries`, contacts, year_stats and search_index are updated per
+# batch too.
+class BulkLoader:
+    def __init__(self, session, batch_size=DEFAULT_BATCH_SIZE, source=None, interactions=None, dedup=True,
+                 progress=None, address_cache_size=ADDRESS_CACHE_SIZE, report=True, summaries=True):
+        self.session = session
+        self.batch_size = batch_size
+        self.source_id = source.id if source is not None else None
+        self.interactions = interactions
+        self.dedup = dedup
+        self.progress = progress
+        self.address_cache_size = address_cache_size
+        self.report = report
+        self.summaries = summaries
+        self.checkpoint = None
+        self.pending = []
+        self.pending_rows = 0
+        self.rows_written = 0
+        self.messages_written = 0
+        self.duplicates = 0
+        self.started = None
+        self.address_ids = {}
+        self.header_set_ids = {}
+        # Contacts are upserted on the raw cursor, so dates are converted to
+        # the same text the DateTime columns store
+        dialect = session.get_bind().dialect
+        self.date_processor = Contact.__table__.c.first_date.type.dialect_impl(dialect).bind_processor(dialect)
+        self.next_message_id = self._next_id(Message)
+        self.next_address_id = self._next_id(Address)
+
+    def _next_id(self, model):
+        # This process is the only writer, so ids can be handed out locally
+        return (self.session.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def add_message(self, record, end_offset=None):
+        self.pending.append(record)
+        self.checkpoint = end_offset
+        self.pending_rows += len(record[-1])
+        if self.progress is not None:
+            self.progress.update(end_offset)
+        if self.pending_rows >= self.batch_size:
+            self.flush()
+
+    def _header_set_id(self, headers):
+        header_set_id = self.header_set_ids.get(headers)
+        if header_set_id is None:
+            header_set_id = self.session.execute(
+                select(HeaderSet.id).where(HeaderSet.headers == headers)).scalar()
+            if header_set_id is None:
+                header_set_id = self.session.execute(
+                    HeaderSet.__table__.insert().values(headers=headers)).inserted_primary_key[0]
+            self.header_set_ids[headers] = header_set_id
+        return header_set_id
+
+    def _resolve_addresses(self, emails):
+        # Keep the cache bounded; evicted addresses are simply looked up again
+        if len(self.address_ids) > self.address_cache_size:
+            self.address_ids.clear()
+
+        missing = list({email for email in emails if email not in self.address_ids})
+        for i in range(0, len(missing), SQL_IN_CHUNK):
+            chunk = missing[i:i + SQL_IN_CHUNK]
+            for address_id, email in self.session.execute(
+                    select(Address.id, Address.email).where(Address.email.in_(chunk))):
+                self.address_ids[email] = address_id
+
+        new_rows = []
+        for email in missing:
+            if email not in self.address_ids:
+                self.address_ids[email] = self.next_address_id
+                new_rows.append({"id": self.next_address_id, "email": email})
+                self.next_address_id += 1
+        if new_rows:
+            self.session.execute(Address.__table__.insert(), new_rows)
+
+    def _drop_duplicates(self, records):
+        # Digests already stored (by this or any earlier run), looked up in
+        # one indexed query per chunk; only the current batch is held in memory
+        digests = list({record[0] for record in records})
+        seen = set()
+        for i in range(0, len(digests), SQL_IN_CHUNK):
+            chunk = digests[i:i + SQL_IN_CHUNK]
+            seen.update(self.session.execute(select(Message.digest).where(Message.digest.in_(chunk))).scalars())
+
+        kept = []
+        for record in records:
+            if record[0] in seen:
+                self.duplicates += 1
+            else:
+                seen.add(record[0])
+                kept.append(record)
+        return kept
+
+    def _update_contacts(self, records):
+        # Aggregate the batch per address, then merge it into contacts with
+        # one executemany upsert on the raw cursor. Dates are converted to
+        # their stored text once per message; that text sorts in date order,
+        # so the min/max below can compare it directly. Returns the batch's
+        # address ids.
+        batch = {}
+        to_db = self.date_processor
+        for _, _, msg_date, _, _, rows in records:
+            msg_date = to_db(msg_date)
+            for _, email, _, _, full_name, marker_bits in rows:
+                address_id = self.address_ids[email]
+                direct = 1 if marker_bits & DIRECT else 0
+                listserv = 1 if marker_bits & LISTSERV else 0
+                contact = batch.get(address_id)
+                if contact is None:
+                    batch[address_id] = [address_id, email_domain(email), full_name if msg_date is not None else None,
+                                         1, msg_date, msg_date, direct, listserv]
+                    continue
+                contact[3] += 1
+                contact[6] += direct
+                contact[7] += listserv
+                if msg_date is not None:
+                    if contact[4] is None or msg_date < contact[4]:
+                        contact[4] = msg_date
+                        contact[2] = full_name
+                    if contact[5] is None or msg_date > contact[5]:
+                        contact[5] = msg_date
+        self.session.connection().exec_driver_sql(
+            f"INSERT INTO contacts ({CONTACTS_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?) {CONTACTS_MERGE}",
+            [tuple(contact) for contact in batch.values()])
+        return batch.keys()
+
+    def _update_year_stats(self, records):
+        batch = {}
+        for _, _, msg_date, _, _, rows in records:
+            year = msg_date.year if msg_date is not None else 0
+            stats = batch.get(year)
+            if stats is None:
+                stats = batch[year] = [year, 0, 0, 0]
+            stats[1] += 1
+            stats[2] += len(rows)
+            stats[3] += sum(1 for row in rows if row[5] & AUTOMATED)
+        self.session.connection().exec_driver_sql(
+            f"INSERT INTO year_stats (year, messages, occurrences, automated) VALUES (?, ?, ?, ?) {YEAR_STATS_MERGE}",
+            [tuple(stats) for stats in batch.values()])
+
+    def flush(self):
+        if not self.pending:
+            return
+        if self.dedup:
+            with STATS.phase("dedup"):
+                records = self._drop_duplicates(self.pending)
+        else:
+            records = self.pending
+        insert_started = time.perf_counter()
+        self._resolve_addresses(email for record in records for _, email, *_ in record[-1])
+
+        message_rows = []
+        occurrence_rows = []
+        interactions = self.interactions
+        for digest, header_message_id, msg_date, raw_headers_str, is_listserv, rows in records:
+            message_id = self.next_message_id
+            self.next_message_id += 1
+            message_rows.append({
+                "id": message_id,
+                "source_id": self.source_id,
+                "digest": digest,
+                "header_message_id": header_message_id,
+                "message_date": msg_date,
+                "header_set_id": self._header_set_id(raw_headers_str),
+                "is_listserv": is_listserv,
+            })
+            senders = []
+            recipients = []
+            for header_context, email, first_name, last_name, full_name, marker_bits in rows:
+                address_id = self.address_ids[email]
+                occurrence_rows.append({
+                    "message_id": message_id,
+                    "address_id": address_id,
+                    "first_name": first_name,
+                    "last_name": last_name,
+                    "name": full_name,
+                    "header_context": header_context,
+                    "marker_bits": marker_bits,
+                })
+                if header_context == "from":
+                    senders.append(address_id)
+                else:
+                    recipients.append(address_id)
+            if interactions is not None and senders and recipients:
+                interactions.add_message(senders, recipients)
+
+        if message_rows:
+            self.session.execute(Message.__table__.insert(), message_rows)
+        if occurrence_rows:
+            self.session.execute(MboxOccurrence.__table__.insert(), occurrence_rows)
+        STATS.phases["db_insert"] += time.perf_counter() - insert_started
+        if self.summaries:
+            with STATS.phase("aggregate"):
+                if occurrence_rows:
+                    address_ids = self._update_contacts(records)
+                if message_rows:
+                    self._update_year_stats(records)
+            if occurrence_rows:
+                with STATS.phase("search_index"):
+                    index_contacts(self.session.connection(), address_ids)
+        self.rows_written += len(occurrence_rows)
+        self.messages_written += len(message_rows)
+        self.pending = []
+        self.pending_rows = 0
+
+        with STATS.phase("commit"):
+            if self.source_id is not None and self.checkpoint is not None:
+                self.session.execute(IngestedFile.__table__.update().where(
+                    IngestedFile.id == self.source_id).values(checkpoint=self.checkpoint))
+            self.session.commit()
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.progress is not None:
+            self.progress.close()
+        if exc_type is None:
+            self.flush()
+        if exc_type is None and self.report:
+            STATS.count("messages_written", self.messages_written)
+            STATS.count("occurrences_written", self.rows_written)
+            STATS.count("duplicates_skipped", self.duplicates)
+            elapsed = time.perf_counter() - self.started
+            rate = self.rows_written / elapsed if elapsed > 0 else 0
+            summary = f"  Loaded {self.rows_written} occurrences in {elapsed:.1f}s ({rate:,.0f} rows/sec)"
+            if self.duplicates:
+                summary += f", skipped {self.duplicates} duplicate messages"
+            print(summary)
+        return False
+
+# Extract the occurrence rows for a single message. Returns a compact tuple
+# (digest, header_message_id, msg_date, raw_headers_str, is_listserv, rows) where each row is
+# (header_context, email, first_name, last_name, full_name, marker_bits).
+# This is pure CPU work, so it is what the worker processes run.
+def extract_message(msg):
+    started = time.perf_counter()
+    headers = msg.keys()
+    msg_headers_lower = [h.lower() for h in headers]
+    date_header = msg.get("Date")
+    try:
+        msg_date = parse_date(date_header) if date_header else None  # Naive local time
+    except Exception:
+        msg_date = None
+        STATS.count("malformed_dates")
+
+    # Compute markers based on message headers
+    marker_bits = LISTSERV if RULES.is_listserv_message(msg_headers_lower) else 0
+    is_listserv = bool(marker_bits)
+
+    # raw_headers: comma-separated list of header keys in lower-case
+    raw_headers_str = ",".join(msg_headers_lower)
+
+    header_message_id = msg.get("Message-ID")
+    header_message_id = str(header_message_id).strip() if header_message_id else None
+
+    rows = []
+    fields = ["From", "To"]
+    address_started = time.perf_counter()
+
+    for field in fields:
+        if field in msg:
+            addresses, malformed = NORMALIZER.addresses(msg[field])
+            if malformed:
+                STATS.count("malformed_addresses", malformed)
+
+            # Use the current field as the header context
+            header_context = field.lower()
+            for email, first_name, last_name, full_name, automated in addresses:
+                # Automated addresses add a marker that carries over to the
+                # rest of the message's addresses
+                if automated:
+                    marker_bits |= AUTOMATED
+                rows.append((header_context, email, first_name, last_name, full_name, marker_bits))
+
+    address_time = time.perf_counter() - address_started
+    digest = message_digest(header_message_id, msg)
+    phases = STATS.phases
+    phases["address_parse"] += address_time
+    phases["header_parse"] += time.perf_counter() - started - address_time
+    counters = STATS.counters
+    counters["messages_scanned"] += 1
+    counters["addresses"] += len(rows)
+    return digest, header_message_id, msg_date, raw_headers_str, is_listserv, rows
+
+# Parse the header block of one message and extract its occurrence rows
+def scan_message(header_bytes):
+    started = time.perf_counter()
+    msg = parse_headers(header_bytes)
+    STATS.phases["header_parse"] += time.perf_counter() - started
+    return extract_message(msg)
+
+# Scan a byte range of an mbox file and return (end_offset, record) for each
+# message, plus this worker's phase timings and counters. Runs in a worker
+# process when --workers is greater than 1.
+def scan_mbox_range(task):
+    mbox_path, start, end = task
+    headers = STATS.timed(iter_message_headers(mbox_path, start, end), "read")
+    return [(stop, scan_message(header_bytes)) for _, stop, header_bytes in headers], STATS.drain()
+
+# Parse a batch of (end_offset, header_bytes) read from a compressed stream.
+# Runs in a worker process when --workers is greater than 1.
+def scan_header_batch(batch):
+    return [(stop, scan_message(header_bytes)) for stop, header_bytes in batch], STATS.drain()
+
+# Collects the (sender, recipient) address id pairs of ingested messages for
+# the interactions table, within a memory budget. Each pair is packed into
+# one 64-bit integer and appended to an array. When the array reaches the
+# budget it is sorted and de-duplicated in place of the distinct pairs held
+# so far; once the distinct pairs alone fill half the budget they are
+# spilled to SQLite (INSERT OR IGNORE) and dropped from memory. `flush`
+# writes whatever is left and is called as each file is finished.
+# numpy is imported with the first tracker, so runs that load no mail (and
+# --help) start without it.
+class InteractionTracker:
+    def __init__(self, session, budget_bytes):
+        import numpy
+        self.np = numpy
+        self.session = session
+        # De-duplicating briefly needs about three times the packed pairs
+        self.capacity = max(budget_bytes // (3 * 8), SPILL_CHUNK)
+        self.pending = array("q")
+        self.distinct = numpy.empty(0, dtype=numpy.int64)
+
+    def add_message(self, senders, recipients):
+        pending = self.pending
+        for sender in senders:
+            high = sender << 32
+            for recipient in recipients:
+                pending.append(high | recipient)
+        if len(pending) + len(self.distinct) >= self.capacity:
+            self._compact()
+
+    def _compact(self):
+        np = self.np
+        with STATS.phase("interactions"):
+            pairs = np.union1d(self.distinct, np.frombuffer(self.pending, dtype=np.int64))
+            self.pending = array("q")
+            if len(pairs) * 2 >= self.capacity:
+                self._spill(pairs)
+                pairs = np.empty(0, dtype=np.int64)
+            self.distinct = pairs
+
+    def _spill(self, pairs):
+        conn = self.session.connection()
+        for i in range(0, len(pairs), SPILL_CHUNK):
+            chunk = pairs[i:i + SPILL_CHUNK]
+            conn.exec_driver_sql("INSERT OR IGNORE INTO interactions (sender_id, recipient_id) VALUES (?, ?)",
+                                 list(zip((chunk >> 32).tolist(), (chunk & 0xFFFFFFFF).tolist())))
+        STATS.count("interaction_spills")
+
+    def flush(self):
+        self._compact()
+        if len(self.distinct):
+            with STATS.phase("interactions"):
+                self._spill(self.distinct)
+            self.distinct = self.np.empty(0, dtype=self.np.int64)
+
+# Per-file ingest state: the ledger entry, where reading starts, and the
+# interaction tracker of the file's loader
+class MboxState:
+    def __init__(self, mbox_path, entry, start):
+        self.mbox_path = mbox_path
+        self.entry = entry
+        self.start = start
+        self.interactions = None
+        self.end = None  # offset reached in a compressed stream
+        self.total = None  # uncompressed size, when known, for the progress ETA
+
+# Check an mbox file against the ledger. Returns None when it is unchanged,
+# otherwise its MboxState. When picking up an interrupted file, the
+# interactions of the part already in the database are recorded first (they
+# may not have been written before the interruption).
+def start_mbox(mbox_path, session, member=None):
+    entry, start, previously_completed = check_ledger(session, mbox_path, "mbox", member)
+    if member is not None:
+        mbox_path = f"{mbox_path}!{member.name}"
+    if start is None:
+        print(f"Skipping unchanged MBOX file: {mbox_path}")
+        STATS.count("files_skipped")
+        return None
+
+    state = MboxState(mbox_path, entry, start)
+    if member is not None:
+        state.total = None if is_compressed(member.name) else member.size
+    elif not is_compressed(mbox_path):
+        state.total = os.path.getsize(mbox_path)
+    if start > 0 and not previously_completed:
+        with STATS.phase("interactions"):
+            derive_interactions(session, entry.id)
+            session.commit()
+    return state
+
+def announce_mbox(state):
+    if state.start > 0:
+        print(f"Resuming MBOX file: {state.mbox_path} from byte {state.start}...")
+    else:
+        print(f"Processing MBOX file: {state.mbox_path}...")
+
+# The bulk loader for a file. --memory-budget is split between its address
+# cache and the file's interaction tracker.
+def mbox_loader(session, args, state):
+    budget = args.memory_budget * 1024 * 1024 // 2
+    state.interactions = InteractionTracker(session, budget)
+    progress = Progress(os.path.basename(state.mbox_path), state.total, state.start, enabled=SHOW_PROGRESS)
+    return BulkLoader(session, args.batch_size, state.entry, interactions=state.interactions,
+                      dedup=not args.keep_duplicates, progress=progress,
+                      address_cache_size=budget // ADDRESS_CACHE_ENTRY_BYTES)
+
+# Write out the file's interactions and mark it as ingested. The "direct"
+# marker waits until all files are in (resolve_direct).
+def finish_mbox(session, state):
+    state.interactions.flush()
+    with STATS.phase("commit"):
+        complete_source(session, state.entry, state.end)
+    STATS.files.append({"path": state.mbox_path, "start": state.start, "end": state.entry.checkpoint})
+
+# Process a single mbox file (plain, compressed, or a tar/zip bundle of mbox
+# files) and insert occurrences into the database
+def process_mbox(mbox_path, args, session):
+    if is_bundle(mbox_path):
+        for member in iter_bundle_members(mbox_path):
+            state = start_mbox(mbox_path, session, member)
+            if state is not None:
+                load_mbox_stream(state, member.stream, args, session)
+        return
+
+    state = start_mbox(mbox_path, session)
+    if state is None:
+        return
+    if is_compressed(mbox_path):
+        with open_stream(mbox_path) as stream:
+            load_mbox_stream(state, stream, args, session)
+        return
+    announce_mbox(state)
+
+    # Only the header block of each message is parsed; bodies are skipped
+    with mbox_loader(session, args, state) as loader:
+        for _, end_offset, header_bytes in STATS.timed(iter_message_headers(mbox_path, state.start), "read"):
+            loader.add_message(scan_message(header_bytes), end_offset)
+
+    finish_mbox(session, state)
+
+# Ingest a decompressed mbox stream. A background thread reads (and so
+# decompresses) ahead while the headers are parsed here, or by the worker
+# pool in batches with --workers.
+def load_mbox_stream(state, stream, args, session):
+    announce_mbox(state)
+    headers = STATS.timed(iter_stream_headers(read_ahead(stream), state.start), "read")
+    if args.workers > 1:
+        batches = iter_header_batches(headers, STREAM_TASK_MESSAGES)
+        results = iter_shard_results(((0, batch) for batch in batches), args.workers, scan_header_batch)
+        scanned = (item for _, batch_results in results for item in batch_results)
+    else:
+        scanned = ((stop, scan_message(header_bytes)) for _, stop, header_bytes in headers)
+
+    state.end = state.start
+    with mbox_loader(session, args, state) as loader:
+        for end_offset, record in scanned:
+            loader.add_message(record, end_offset)
+            state.end = end_offset
+    finish_mbox(session, state)
+
+def iter_header_batches(headers, size):
+    while True:
+        batch = [(stop, header_bytes) for _, stop, header_bytes in islice(headers, size)]
+        if not batch:
+            return
+        yield batch
+
+# Worker process setup. A forked worker starts with a copy of this process's
+# STATS, and only what the worker does itself should travel back.
+def init_worker(rules):
+    STATS.drain()
+    use_rules(rules)
+
+# Run `scan` (scan_mbox_range by default) over the tasks in a process pool and
+# yield (file_index, results) in task order. Only a bounded window of tasks is
+# in flight, so finished results don't pile up while the writer catches up.
+# The timings and counters each task returns are merged into STATS.
+def iter_shard_results(tasks, workers, scan=scan_mbox_range):
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(RULES,)) as pool:
+        pending = deque()
+        task_iter = iter(tasks)
+        for file_index, task in islice(task_iter, workers * 2):
+            pending.append((file_index, pool.submit(scan, task)))
+
+        while pending:
+            file_index, future = pending.popleft()
+            next_task = next(task_iter, None)
+            if next_task is not None:
+                pending.append((next_task[0], pool.submit(scan, next_task[1])))
+            results, worker_stats = future.result()
+            STATS.merge(worker_stats)
+            yield file_index, results
+
+# Process several mbox files with a pool of worker processes. Compressed files
+# and bundles cannot be split into byte ranges, so they are streamed one at a
+# time (still parsed by the pool) between runs of plain files, keeping the
+# command-line order.
+def process_mbox_parallel(mbox_paths, args, session):
+    plain = []
+    for mbox_path in mbox_paths:
+        if is_bundle(mbox_path) or is_compressed(mbox_path):
+            process_mbox_shards(plain, args, session)
+            plain = []
+            process_mbox(mbox_path, args, session)
+        else:
+            plain.append(mbox_path)
+    process_mbox_shards(plain, args, session)
+
+# Each plain file is split into byte-range shards aligned on message
+# boundaries; workers parse the shards and this (single writer) process
+# inserts the results in file order, so the database ends up identical to a
+# serial run.
+def process_mbox_shards(mbox_paths, args, session):
+    if not mbox_paths:
+        return
+    states = []
+    tasks = []
+    for mbox_path in mbox_paths:
+        state = start_mbox(mbox_path, session)
+        if state is None:
+            continue
+        for start, end in plan_shards(mbox_path, SHARD_BYTES, state.start):
+            tasks.append((len(states), (mbox_path, start, end)))
+        states.append(state)
+
+    groups = groupby(iter_shard_results(tasks, args.workers), key=itemgetter(0))
+    group = next(groups, None)
+    for state_index, state in enumerate(states):
+        # A file with nothing new to read (e.g. resumed at its end) has no shards
+        if group is not None and group[0] == state_index:
+            load_mbox_shards(state, group[1], args, session)
+            group = next(groups, None)
+        else:
+            load_mbox_shards(state, (), args, session)
+
+def load_mbox_shards(state, shards, args, session):
+    announce_mbox(state)
+    with mbox_loader(session, args, state) as loader:
+        for _, scanned in shards:
+            for end_offset, record in scanned:
+                loader.add_message(record, end_offset)
+    finish_mbox(session, state)
+
+# --sharded: each plain MBOX file is cut into SHARD_BYTES ranges (a
+# compressed file is one range, read from its checkpoint to the end) and
+# every range is loaded into a database of its own by a worker process, so
+# the loading itself runs in parallel, not just the parsing. The shards are
+# merged into the output in command-line order as they finish, and each
+# merge moves the file's checkpoint to the end of its range, so the result
+# -- and where an interrupted run resumes -- is as for a serial run.
+# Bundles are loaded into the output directly, in their place.
+def process_mbox_sharded(mbox_paths, args, session):
+    shard_dir = tempfile.mkdtemp(prefix=".shards-", dir=os.path.dirname(os.path.abspath(args.output)))
+    try:
+        plain = []
+        for mbox_path in mbox_paths:
+            if is_bundle(mbox_path):
+                load_shards(plain, args, session, shard_dir)
+                plain = []
+                process_mbox(mbox_path, args, session)
+            else:
+                plain.append(mbox_path)
+        load_shards(plain, args, session, shard_dir)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+def load_shards(mbox_paths, args, session, shard_dir):
+    states = []
+    tasks = []
+    budget = args.memory_budget * 1024 * 1024 // 2
+    for mbox_path in mbox_paths:
+        state = start_mbox(mbox_path, session)
+        if state is None:
+            continue
+        if is_compressed(mbox_path):
+            ranges = [(state.start, None)]
+        else:
+            ranges = plan_shards(mbox_path, SHARD_BYTES, state.start)
+        for start, end in ranges:
+            shard_path = os.path.join(shard_dir, f"{len(tasks)}.db")
+            task = (shard_path, mbox_path, start, end, args.batch_size, not args.keep_duplicates, budget)
+            tasks.append((len(states), task))
+        states.append(state)
+    if not states:
+        return
+
+    progress = Progress("shards", len(tasks), unit="shards", enabled=SHOW_PROGRESS)
+    groups = groupby(iter_shard_results(tasks, args.workers, ingest_shard), key=itemgetter(0))
+    group = next(groups, None)
+    for state_index, state in enumerate(states):
+        progress.close()
+        announce_mbox(state)
+        state.end = state.start
+        # A file with nothing new to read (e.g. resumed at its end) has no shards
+        if group is not None and group[0] == state_index:
+            for _, (shard_path, end, shard_duplicates) in group[1]:
+                with STATS.phase("merge"):
+                    messages, occurrences, duplicates = merge_database(
+                        session, shard_path, dedup=not args.keep_duplicates,
+                        source_id=state.entry.id, checkpoint=end)
+                os.remove(shard_path)
+                count_merged(messages, occurrences, duplicates + shard_duplicates)
+                state.end = end
+                progress.update(progress.position + 1)
+            group = next(groups, None)
+        with STATS.phase("commit"):
+            complete_source(session, state.entry, state.end if is_compressed(state.mbox_path) else None)
+        STATS.files.append({"path": state.mbox_path, "start": state.start, "end": state.entry.checkpoint})
+    progress.close()
+
+# Load one range of an mbox file (for a compressed file, everything from
+# `start` on when `end` is None) into a new database at `shard_path`. Runs
+# in a worker process for --sharded. Only the messages and occurrences are
+# written: merge_database brings the summary tables up to date from them.
+# Returns (shard_path, end offset, duplicate messages dropped) and the
+# worker's STATS.
+def ingest_shard(task):
+    shard_path, mbox_path, start, end, batch_size, dedup, budget = task
+    session = get_session(shard_path)
+    with fast_load(session), BulkLoader(session, batch_size, dedup=dedup, report=False, summaries=False,
+                                        address_cache_size=budget // ADDRESS_CACHE_ENTRY_BYTES) as loader:
+        if end is None:
+            end = start
+            with open_stream(mbox_path) as stream:
+                headers = iter_stream_headers(read_ahead(stream), start)
+                for _, end, header_bytes in STATS.timed(headers, "read"):
+                    loader.add_message(scan_message(header_bytes), end)
+        else:
+            for _, stop, header_bytes in STATS.timed(iter_message_headers(mbox_path, start, end), "read"):
+                loader.add_message(scan_message(header_bytes), stop)
+    session.close()
+    session.get_bind().dispose()
+    return (shard_path, end, loader.duplicates), STATS.drain()
+
+# Merge databases written by other runs (--merge), e.g. the same ingest run
+# on another machine for a different set of files, into the output
+def merge_databases(db_paths, args, session):
+    for db_path in db_paths:
+        print(f"Merging database: {db_path}...")
+        started = time.perf_counter()
+        with STATS.phase("merge"):
+            messages, occurrences, duplicates = merge_database(session, db_path, dedup=not args.keep_duplicates)
+        count_merged(messages, occurrences, duplicates)
+        summary = f"  Merged {occurrences} occurrences in {time.perf_counter() - started:.1f}s"
+        if duplicates:
+            summary += f", skipped {duplicates} duplicate messages"
+        print(summary)
+        STATS.files.append({"path": db_path})
+
+def count_merged(messages, occurrences, duplicates):
+    STATS.count("messages_written", messages)
+    STATS.count("occurrences_written", occurrences)
+    STATS.count("duplicates_skipped", duplicates)
+
 # Functions for VCF ingestion
 
 def parse_vcf_card(card_lines):
     """
     Given a list of lines corresponding to a single VCF card (between BEGIN:VCARD and END:VCARD),
-    parse out the email, names, etc.
+    parse out the email addresses, names, etc.
     """
     contact = {
-        "email": None,
+        "emails": [],
         "first_name": "",
         "last_name": "",
         "name": ""
@@ -209,8 +893,10 @@ def parse_vcf_card(card_lines):
         if line.startswith("EMAIL"):
             # e.g., EMAIL;TYPE=INTERNET:john.doe@gmail.com
             parts = line.split(":")
-            if len(parts) > 1:
-                contact["email"] = parts[1].strip()
+            if len(parts) > 1 and parts[1].strip():
+                email = parts[1].strip().lower()
+                if email not in contact["emails"]:
+                    contact["emails"].append(email)
         elif line.startswith("N:"):
             # N:Last;First;Additional;... (fields separated by ;)
             parts = line[2:].split(";")
@@ -233,100 +919,122 @@ def parse_vcf_card(card_lines):
                     contact["first_name"] = fn
     return contact
 
-def ingest_vcf_file(vcf_path, session):
+def iter_vcf_cards(f):
+    """
+    Yield the parsed contact of each vCard in an open VCF file, one card at a time.
+    """
+    card_lines = []
+    in_card = False
+    for line in f:
+        line = line.strip()
+        if line.upper() == "BEGIN:VCARD":
+            in_card = True
+            card_lines = []
+        elif line.upper() == "END:VCARD":
+            in_card = False
+            yield parse_vcf_card(card_lines)
+        elif in_card:
+            card_lines.append(line)
+
+# VCF data is authoritative: an address already in vcf_contacts gets the
+# card's names
+VCF_UPSERT = text("""
+    INSERT INTO vcf_contacts (email, first_name, last_name, name)
+    VALUES (:email, :first_name, :last_name, :name)
+    ON CONFLICT (email) DO UPDATE SET
+        first_name = excluded.first_name,
+        last_name = excluded.last_name,
+        name = excluded.name
+""")
+
+# CSV data only fills in fields that are still empty. `name` is the value
+# stored for a new address (falling back to a name guessed from the email),
+# `csv_name` the one from the file used to fill an existing record.
+CSV_UPSERT = text("""
+    INSERT INTO vcf_contacts (email, first_name, last_name, name)
+    VALUES (:email, :first_name, :last_name, :name)
+    ON CONFLICT (email) DO UPDATE SET
+        first_name = CASE WHEN COALESCE(vcf_contacts.first_name, '') = '' AND excluded.first_name != ''
+                          THEN excluded.first_name ELSE vcf_contacts.first_name END,
+        last_name = CASE WHEN COALESCE(vcf_contacts.last_name, '') = '' AND excluded.last_name != ''
+                         THEN excluded.last_name ELSE vcf_contacts.last_name END,
+        name = CASE WHEN COALESCE(vcf_contacts.name, '') = '' AND :csv_name != ''
+                    THEN :csv_name ELSE vcf_contacts.name END
+""")
+
+def ingest_vcf_file(vcf_path, session, batch_size=DEFAULT_BATCH_SIZE):
     """
     Reads a VCF file, parses individual vCards, and ingests contacts into the database.
+    A card with several EMAIL lines yields one contact per address.
     """
     with open(vcf_path, "r", encoding="utf-8") as f:
-        card_lines = []
-        in_card = False
-        for line in f:
-            line = line.strip()
-            if line.upper() == "BEGIN:VCARD":
-                in_card = True
-                card_lines = []
-            elif line.upper() == "END:VCARD":
-                in_card = False
-                contact_data = parse_vcf_card(card_lines)
-                email = contact_data.get("email")
-                if email:
-                    # Create a new VCFContact record
-                    vcf_contact = VCFContact(
-                        email=email.lower(),
-                        first_name=contact_data.get("first_name"),
-                        last_name=contact_data.get("last_name"),
-                        name=contact_data.get("name") or name_from_email(email)
-                    )
-                    # Check if a contact with the same email already exists and update if found, otherwise add new contact
-                    existing = session.query(VCFContact).filter_by(email=vcf_contact.email).first()
-                    if existing:
-                        existing.name = vcf_contact.name
-                        existing.first_name = vcf_contact.first_name
-                        existing.last_name = vcf_contact.last_name
-                    else:
-                        session.add(vcf_contact)
-            elif in_card:
-                card_lines.append(line)
+        rows = ({
+            "email": email,
+            "first_name": contact["first_name"],
+            "last_name": contact["last_name"],
+            "name": contact["name"] or name_from_email(email)
+        } for contact in iter_vcf_cards(f) for email in contact["emails"])
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            session.execute(VCF_UPSERT, batch)
+            index_vcf_contacts(session.connection(), [row["email"] for row in batch])
+            STATS.count("vcf_rows", len(batch))
         session.commit()
 
-def ingest_csv_contacts(csv_path, session):
+def ingest_csv_contacts(csv_path, session, batch_size=DEFAULT_BATCH_SIZE):
     """
     Reads a CSV file of contacts (with columns for email, first_name, last_name, and name),
     and ingests them into the database (table VCFContact). It de-dupes based on email,
     and for each contact, if a field is empty in the existing record, it will be updated with the
     non-empty value from the CSV. Otherwise, existing non-empty values are preserved.
     """
-    df = pd.read_csv(csv_path)
-    # Normalize email column to lower-case; assume column name is 'Email' or 'email'
-    if 'Email' in df.columns:
-        df['email'] = df['Email'].str.lower()
-    elif 'email' in df.columns:
-        df['email'] = df['email'].str.lower()
-    else:
-        print(f"CSV {csv_path} does not contain an 'Email' column.")
-        return
-    
-    # Standardize column names for first_name, last_name, and name
-    # Look for possible variants
-    def get_field(row, field_names):
-        for name in field_names:
-            if name in row and pd.notna(row[name]):
-                value = str(row[name]).strip()
-                if value:
-                    return value
-        return ""
-    
-    for index, row in df.iterrows():
-        email = row['email']
-        first_name = get_field(row, ['first_name', 'First', 'first'])
-        last_name = get_field(row, ['last_name', 'Last', 'last'])
-        name_field = get_field(row, ['name', 'Name'])
-        
-        # If name_field is empty but first and last exist, combine them
-        if not name_field and (first_name or last_name):
-            name_field = (first_name + " " + last_name).strip()
-        
-        # Query existing contact
-        from mbox_contact_summary import VCFContact
-        existing = session.query(VCFContact).filter_by(email=email).first()
-        if existing:
-            # For each field, if existing is empty and new value is non-empty, update it
-            if not existing.first_name and first_name:
-                existing.first_name = first_name
-            if not existing.last_name and last_name:
-                existing.last_name = last_name
-            if not existing.name and name_field:
-                existing.name = name_field
+    # Imported here so that runs without CSV files never load pandas
+    import pandas as pd
+
+    # Standardize column names for first_name, last_name, and name: take the
+    # first variant that has a non-empty value
+    def get_field(df, field_names):
+        value = pd.Series("", index=df.index)
+        for name in reversed(field_names):
+            if name in df.columns:
+                column = df[name].fillna("").str.strip()
+                value = column.where(column != "", value)
+        return value
+
+    for chunk in pd.read_csv(csv_path, dtype=str, chunksize=batch_size):
+        # Normalize email column to lower-case; assume column name is 'Email' or 'email'
+        if 'Email' in chunk.columns:
+            emails = chunk['Email']
+        elif 'email' in chunk.columns:
+            emails = chunk['email']
         else:
-            # Create a new VCFContact record
-            from mbox_contact_summary import name_from_email
-            new_contact = VCFContact(
-                email=email,
-                first_name=first_name,
-                last_name=last_name,
-                name=name_field or name_from_email(email)
-            )
-            session.add(new_contact)
+            print(f"CSV {csv_path} does not contain an 'Email' column.")
+            return
+        chunk = chunk.assign(email=emails.str.lower()).dropna(subset=['email'])
+        if chunk.empty:
+            continue
+
+        first_name = get_field(chunk, ['first_name', 'First', 'first'])
+        last_name = get_field(chunk, ['last_name', 'Last', 'last'])
+        name_field = get_field(chunk, ['name', 'Name'])
+
+        # If name_field is empty but first and last exist, combine them
+        combined = (first_name + " " + last_name).str.strip()
+        name_field = name_field.where(name_field != "", combined)
+
+        fallback = chunk['email'].map(name_from_email)
+        batch = pd.DataFrame({
+            "email": chunk['email'],
+            "first_name": first_name,
+            "last_name": last_name,
+            "name": name_field.where(name_field != "", fallback),
+            "csv_name": name_field,
+        })
+        session.execute(CSV_UPSERT, batch.to_dict("records"))
+        index_vcf_contacts(session.connection(), batch["email"].tolist())
+        STATS.count("csv_rows", len(batch))
     session.commit()
 
 # Main function with argparse
@@ -335,30 +1043,109 @@ def main():
     parser.add_argument("mbox_files", nargs="*", help="Paths to MBOX files")
     parser.add_argument("--vcf", nargs="*", help="Paths to VCF files")
     parser.add_argument("--csv", nargs="*", help="Paths to CSV contact files")
+    parser.add_argument("--merge", nargs="*", help="Databases written by other runs (e.g. on other machines) to merge into --output")
     parser.add_argument("--output", default="contacts.db", help="SQLite database file (default: contacts.db)")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes for parsing MBOX files (default: 1)")
+    parser.add_argument("--sharded", action="store_true", help="Load each MBOX file, or 64 MB range of one, into its own temporary database in parallel (--workers) and merge them into --output")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help=f"Occurrence rows per INSERT batch (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--keep-duplicates", action="store_true", help="Ingest every copy of a message instead of de-duplicating on Message-ID")
+    parser.add_argument("--memory-budget", type=int, default=DEFAULT_MEMORY_BUDGET_MB, help=f"MB the MBOX ingest may use for its address cache and interaction tracking (default: {DEFAULT_MEMORY_BUDGET_MB})")
+    parser.add_argument("--rebuild-aggregates", action="store_true", help="Recompute the contacts summary and interactions tables from mbox_occurrences")
+    parser.add_argument("--rules", default=None, help="JSON file overriding the built-in categorization rules (see rules.py); kept in the database for later runs")
+    parser.add_argument("--stats-json", default=None, help="Write per-phase timings and counters for the run to this JSON file")
+    parser.add_argument("--profile", default=None, help="Write cProfile stats for the ingest to this file (view with python -m pstats)")
+    parser.add_argument("--no-progress", action="store_true", help="Don't show the live progress line")
     args = parser.parse_args()
+
+    global SHOW_PROGRESS
+    SHOW_PROGRESS = not args.no_progress
+    rules = load_rules(args.rules)
     
     # Create or open the SQLite database using the provided filename
     session = get_session(args.output)
+    # Without --rules, categorize (and mark) as the last run that set them did
+    use_rules(rules if args.rules else stored_rules(session))
+    # An interrupted run may have left indexes dropped; put them back first
+    with STATS.phase("index_build"):
+        rebuild_dropped_indexes(session)
+
+    with profiled(args.profile):
+        ingest(args, session)
+
+    STATS.print_summary()
+    if args.stats_json:
+        STATS.write_json(args.stats_json, database=args.output, workers=args.workers)
     
+    print(f"✅ Done! Data stored in {args.output}")
+
+def ingest(args, session):
     # Process CSV contact files first
     if args.csv:
         for csv_path in args.csv:
+            entry, start, _ = check_ledger(session, csv_path, "csv")
+            if start is None:
+                print(f"Skipping unchanged CSV contacts file: {csv_path}")
+                STATS.count("files_skipped")
+                continue
             print(f"Processing CSV contacts file: {csv_path}...")
-            ingest_csv_contacts(csv_path, session)
+            with STATS.phase("csv_ingest"):
+                ingest_csv_contacts(csv_path, session, args.batch_size)
+                complete_source(session, entry)
+            STATS.files.append({"path": csv_path})
     
-    # Process each MBOX file and ingest data into the database
+    # A file named twice (or through a symlink) is loaded once: the ledger
+    # entries of parallel and sharded runs are all created before any file
+    # completes, so it would not catch the repeat
+    unique = {}
     for mbox_path in args.mbox_files:
-        print(f"Processing MBOX file: {mbox_path}...")
-        process_mbox(mbox_path, args, session)
+        unique.setdefault(os.path.realpath(mbox_path), mbox_path)
+    if len(unique) < len(args.mbox_files):
+        print(f"Ignoring {len(args.mbox_files) - len(unique)} repeated MBOX path(s)")
+        args.mbox_files = list(unique.values())
+
+    # Merge other databases, then process each MBOX file and ingest data
+    # into the database
+    if args.merge or args.mbox_files:
+        with fast_load(session):
+            merge_databases(args.merge or [], args, session)
+            if args.sharded:
+                process_mbox_sharded(args.mbox_files, args, session)
+            elif args.workers > 1:
+                process_mbox_parallel(args.mbox_files, args, session)
+            else:
+                for mbox_path in args.mbox_files:
+                    process_mbox(mbox_path, args, session)
+
+    if args.rebuild_aggregates:
+        print("Rebuilding contact aggregates...")
+        with STATS.phase("rebuild_aggregates"):
+            rebuild_aggregates(session)
+            rebuild_interactions(session)
+
+    if args.merge or args.mbox_files or args.rebuild_aggregates:
+        with STATS.phase("direct_marker"):
+            owner, direct = resolve_direct(session)
+        STATS.count("direct_addresses", direct)
+        print(f"Owner: {owner}, {direct} direct contacts")
+
+    if args.merge or args.mbox_files or args.rebuild_aggregates or args.rules:
+        with STATS.phase("categorize"):
+            counts, _ = recategorize(session, RULES)
+        print("Categorized contacts: " + ", ".join(f"{counts.get(c, 0)} {c}" for c in CATEGORIES))
     
     # Process each VCF file and ingest contacts into the database
     if args.vcf:
         for vcf_path in args.vcf:
+            entry, start, _ = check_ledger(session, vcf_path, "vcf")
+            if start is None:
+                print(f"Skipping unchanged VCF file: {vcf_path}")
+                STATS.count("files_skipped")
+                continue
             print(f"Processing VCF file: {vcf_path}...")
-            ingest_vcf_file(vcf_path, session)
-    
-    print(f"✅ Done! Data stored in {args.output}")
+            with STATS.phase("vcf_ingest"):
+                ingest_vcf_file(vcf_path, session, args.batch_size)
+                complete_source(session, entry)
+            STATS.files.append({"path": vcf_path})
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
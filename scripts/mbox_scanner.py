@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Header-only streaming reader for MBOX files.
+
+`mailbox.mbox` parses every message in full (including attachment bodies)
+even when only a handful of headers are needed. This module memory-maps the
+file, locates the "From " separator lines and hands back just the header
+block of each message, leaving the body bytes untouched.
+
+Compressed files (.gz, .xz, .zst) and tar/zip bundles of MBOX files cannot
+be memory-mapped; they are decompressed as a stream in a background thread
+and scanned the same way, chunk by chunk.
+"""
+import gzip
+import lzma
+import mmap
+import os
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+from email import policy
+from email.parser import BytesHeaderParser
+
+SEPARATOR = b"\nFrom "
+
+# How much of the mapping to scan before handing pages back to the OS
+RELEASE_BYTES = 64 * 1024 * 1024
+
+# Size of the reads from a decompressed stream, and how many chunks the
+# background reader may decompress ahead of the scanner
+CHUNK_BYTES = 1024 * 1024
+READ_AHEAD_CHUNKS = 8
+
+COMPRESSED_SUFFIXES = (".gz", ".xz", ".zst")
+BUNDLE_SUFFIXES = (".zip", ".tar", ".tgz", ".txz", ".tar.gz", ".tar.xz", ".tar.zst")
+
+# Bundle members with these names (optionally compressed) are read as MBOX files
+MBOX_MEMBER_SUFFIXES = (".mbox", ".mbx")
+
+# Same policy mailbox.mbox uses, so header values come back identically
+_header_parser = BytesHeaderParser(policy=policy.compat32)
+
+
+def parse_headers(header_bytes):
+    """
+    Parse a raw header block into an email.message.Message (headers only).
+    """
+    return _header_parser.parsebytes(header_bytes)
+
+
+def _advise(mm, option, *args):
+    # madvise is a hint; it is missing on some platforms (e.g. Windows)
+    if option is None or not hasattr(mm, "madvise"):
+        return
+    try:
+        mm.madvise(option, *args)
+    except OSError:
+        pass
+
+
+def _header_end(mm, start, stop):
+    """
+    Return the offset just past the header block of a message whose headers
+    begin at `start`. The header block ends at the first blank line, or at
+    `stop` if the message has no body.
+    """
+    # Search from the newline ending the previous line so an empty header
+    # block (message starting with a blank line) is detected as well
+    search_from = start - 1
+    idx = mm.find(b"\n\n", search_from, stop)
+    limit = idx if idx != -1 else stop
+    # CRLF files: only look as far as the LF blank line (if any) so we never
+    # scan a whole body twice
+    crlf = mm.find(b"\n\r\n", search_from, limit)
+    if crlf != -1:
+        return crlf + 1
+    return idx + 1 if idx != -1 else stop
+
+
+def iter_message_headers(mbox_path, start=0, end=None):
+    """
+    Yield (offset, end, header_bytes) for each message in an MBOX file.
+
+    `offset` is the position of the message's "From " separator line and
+    `end` the position just past the message (the next separator, or EOF),
+    which is where reading can pick up again after this message. Only
+    messages whose separator starts in [start, end) are returned, which lets
+    callers read a byte range of a large file. `start` must be 0 or the
+    offset of a separator line.
+    """
+    with open(mbox_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            _advise(mm, getattr(mmap, "MADV_SEQUENTIAL", None))
+            released = start - start % mmap.PAGESIZE
+            end = size if end is None else min(end, size)
+
+            # Anything before the first separator line is not part of a message
+            pos = start
+            if mm[pos:pos + 5] != b"From ":
+                pos = mm.find(SEPARATOR, pos)
+                pos = pos + 1 if pos != -1 else size
+
+            while pos < end:
+                line_end = mm.find(b"\n", pos)
+                if line_end == -1:
+                    # Separator line at EOF with no message content
+                    yield pos, size, b""
+                    break
+
+                next_sep = mm.find(SEPARATOR, line_end)
+                stop = next_sep + 1 if next_sep != -1 else size
+
+                header_start = line_end + 1
+                yield pos, stop, mm[header_start:_header_end(mm, header_start, stop)]
+                pos = stop
+
+                # Drop pages we have already scanned so resident memory does
+                # not grow with the size of the file
+                if pos - released >= RELEASE_BYTES:
+                    upto = pos - pos % mmap.PAGESIZE
+                    _advise(mm, getattr(mmap, "MADV_DONTNEED", None), released, upto - released)
+                    released = upto
+
+
+def plan_shards(mbox_path, shard_bytes, start=0):
+    """
+    Split an MBOX file (from offset `start`, which must be 0 or a separator
+    line) into [(start, end), ...] byte ranges of roughly `shard_bytes` each.
+    Every boundary falls on a "From " separator line, so each range holds
+    whole messages and can be read with
+    iter_message_headers(mbox_path, start, end) independently.
+    """
+    size = os.path.getsize(mbox_path)
+    if start >= size:
+        return []
+    if size - start <= shard_bytes:
+        return [(start, size)]
+
+    boundaries = [start]
+    with open(mbox_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            target = start + shard_bytes
+            while target < size:
+                idx = mm.find(SEPARATOR, max(target - 1, boundaries[-1]))
+                if idx == -1:
+                    break
+                boundaries.append(idx + 1)
+                target = idx + 1 + shard_bytes
+    boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def is_bundle(path):
+    """
+    True for tar/zip archives holding several MBOX files.
+    """
+    return path.lower().endswith(BUNDLE_SUFFIXES)
+
+
+def is_compressed(path):
+    """
+    True for a single compressed MBOX file (.gz, .xz or .zst).
+    """
+    return not is_bundle(path) and path.lower().endswith(COMPRESSED_SUFFIXES)
+
+
+def _open_zstd(source):
+    # `source` is a path or a binary file object
+    try:
+        from compression import zstd  # Python 3.14+
+        return zstd.ZstdFile(source)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading .zst files requires the zstandard package (pip install zstandard)") from None
+    closefd = isinstance(source, (str, os.PathLike))
+    if closefd:
+        source = open(source, "rb")
+    # Concatenated frames (e.g. mail appended with `zstd >>`) are one stream
+    return zstandard.ZstdDecompressor().stream_reader(source, read_across_frames=True, closefd=closefd)
+
+
+def _decompressor(name):
+    name = name.lower()
+    if name.endswith((".gz", ".tgz")):
+        return gzip.open
+    if name.endswith((".xz", ".txz")):
+        return lzma.open
+    if name.endswith(".zst"):
+        return _open_zstd
+    return None
+
+
+def decompress(fileobj, name):
+    """
+    Wrap a binary file object so reads return decompressed data, based on the
+    compression suffix of `name`. Uncompressed data is returned unchanged.
+    """
+    opener = _decompressor(name)
+    return opener(fileobj) if opener is not None else fileobj
+
+
+def open_stream(path):
+    """
+    Open a (possibly compressed) file as a binary stream of its decompressed bytes.
+    """
+    opener = _decompressor(path)
+    return opener(path) if opener is not None else open(path, "rb")
+
+
+def read_ahead(fileobj, chunk_size=CHUNK_BYTES, depth=READ_AHEAD_CHUNKS):
+    """
+    Yield the contents of `fileobj` in `chunk_size` pieces, read (and hence
+    decompressed) by a background thread up to `depth` chunks ahead. The
+    decompressors release the GIL while working, so decompression overlaps
+    with whatever the caller does with each chunk.
+    """
+    chunks = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            while True:
+                chunk = fileobj.read(chunk_size)
+                if not chunk:
+                    break
+                if not put(chunk):
+                    return
+            put(None)
+        except BaseException as exc:
+            put(exc)
+
+    thread = threading.Thread(target=reader, name="mbox-read-ahead", daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield chunk
+    finally:
+        # Unblock and wait for the reader if the caller stopped early
+        stop.set()
+        thread.join()
+
+
+def iter_stream_headers(chunks, start=0):
+    """
+    Yield (offset, end, header_bytes) for each message of an MBOX stream,
+    given as an iterable of byte chunks (see read_ahead). Offsets count
+    decompressed bytes, and the values are the same iter_message_headers
+    returns for the uncompressed file. Messages before `start` (0 or the
+    offset of a separator line) are skipped. Only a message's header block
+    is held in memory; its body is discarded as it streams past.
+    """
+    chunks = iter(chunks)
+    buf = b""
+    base = 0  # stream offset of buf[0]
+    pos = 0   # start of the current message (or of unscanned data) in buf
+    eof = False
+    # Enough bytes to spot a separator split across two chunks
+    keep = len(SEPARATOR) - 1
+
+    def fill(drop_to=None):
+        # Append the next chunk, first dropping everything before `drop_to`
+        # (default: the current message). Returns False at end of stream.
+        nonlocal buf, base, pos, eof
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            return False
+        drop = pos if drop_to is None else drop_to
+        buf = buf[drop:] + chunk
+        base += drop
+        pos -= drop
+        return True
+
+    # Skip to `start` without keeping the data in between
+    while base + len(buf) <= start:
+        pos = len(buf)
+        if not fill():
+            return
+    pos = start - base
+
+    # Anything before the first separator line is not part of a message
+    while len(buf) - pos < 5 and fill():
+        pass
+    if buf[pos:pos + 5] != b"From ":
+        while True:
+            idx = buf.find(SEPARATOR, pos)
+            if idx != -1:
+                pos = idx + 1
+                break
+            if eof:
+                return
+            pos = max(len(buf) - keep, pos)
+            fill()
+
+    while pos < len(buf) or not eof:
+        # buf[pos:] starts with the separator line of the message at base + pos
+        line_end = buf.find(b"\n", pos)
+        while line_end == -1 and fill():
+            line_end = buf.find(b"\n", pos)
+        if line_end == -1:
+            if pos < len(buf):
+                # Separator line at EOF with no message content
+                yield base + pos, base + len(buf), b""
+            return
+
+        # Read until the end of the header block or of the message is known
+        while True:
+            header_start = line_end + 1
+            blank = buf.find(b"\n\n", header_start - 1)
+            next_sep = buf.find(SEPARATOR, line_end)
+            if next_sep != -1 and (blank == -1 or blank + 2 > next_sep + 1):
+                # The whole message is buffered
+                stop = next_sep + 1
+                yield base + pos, base + stop, buf[header_start:_header_end(buf, header_start, stop)]
+                pos = stop
+                break
+            if blank != -1:
+                crlf = buf.find(b"\n\r\n", header_start - 1, blank)
+                header = buf[header_start:(crlf if crlf != -1 else blank) + 1]
+                msg_start = base + pos
+                # Skip the body, keeping only its last few bytes between chunks
+                scan_from = blank
+                while True:
+                    next_sep = buf.find(SEPARATOR, scan_from)
+                    if next_sep != -1:
+                        yield msg_start, base + next_sep + 1, header
+                        pos = next_sep + 1
+                        break
+                    if eof:
+                        yield msg_start, base + len(buf), header
+                        pos = len(buf)
+                        break
+                    scan_from = max(len(buf) - keep, 0)
+                    old_base = base
+                    fill(drop_to=scan_from)
+                    scan_from -= base - old_base
+                    pos = 0
+                break
+            old_base = base
+            if not fill():
+                # Last message, with no blank line after its headers
+                stop = len(buf)
+                yield base + pos, base + stop, buf[header_start:_header_end(buf, header_start, stop)]
+                pos = stop
+                break
+            line_end -= base - old_base
+
+
+class BundleMember:
+    """
+    An MBOX file inside a tar/zip bundle. `stream` yields its decompressed
+    bytes and is only valid until the bundle iterator moves on.
+    """
+    def __init__(self, name, size, mtime, fingerprint, stream):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.fingerprint = fingerprint
+        self.stream = stream
+
+
+def _is_mbox_member(name):
+    name = name.lower()
+    for suffix in COMPRESSED_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return name.endswith(MBOX_MEMBER_SUFFIXES)
+
+
+def iter_bundle_members(path):
+    """
+    Yield a BundleMember for each MBOX file in a tar or zip bundle, in
+    archive order. Tar bundles (compressed or not) are read as a single
+    forward stream, so each member must be consumed before the next one.
+    """
+    if path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not _is_mbox_member(info.filename):
+                    continue
+                fingerprint = f"zip:{info.file_size}:{info.CRC:08x}"
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                with zf.open(info) as member, decompress(member, info.filename) as stream:
+                    yield BundleMember(info.filename, info.file_size, mtime, fingerprint, stream)
+        return
+
+    with open_stream(path) as raw, tarfile.open(fileobj=raw, mode="r|") as tf:
+        for info in tf:
+            if not info.isfile() or not _is_mbox_member(info.name):
+                continue
+            fingerprint = f"tar:{info.size}:{info.mtime}:{info.chksum}"
+            member = tf.extractfile(info)
+            stream = decompress(member, info.name)
+            yield BundleMember(info.name, info.size, float(info.mtime), fingerprint, stream)
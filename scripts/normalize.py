@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Address, name and date normalization for the ingest's per-message loop.
+
+A mailbox repeats itself: the same From and To values come back on every
+message of a thread, and the same people turn up in different combinations.
+`Normalizer` keeps bounded LRU caches at two levels so each distinct value
+is parsed once per process:
+
+    header   raw From/To value          -> normalized addresses of the header
+    mailbox  one "Name <address>" item  -> its normalized address
+
+A header without comments, group syntax or domain literals is split on the
+commas outside its quoted names and each item goes through the mailbox
+cache, so a new combination of known recipients costs a few dictionary
+lookups; any other header is parsed whole by email.utils.getaddresses, as
+before. Lookups and misses are counted
+in the run's RunStats as `<cache>_cache_lookups` / `<cache>_cache_misses`.
+
+`parse_date` reads the usual RFC 5322 date ("Tue, 15 Jan 2019 10:22:33
++0100") with one regular expression and falls back to
+email.utils.parsedate_to_datetime for anything else. Both paths give the same
+results as the uncached parse.
+"""
+import re
+import time
+from calendar import timegm
+from datetime import datetime
+from email.utils import getaddresses, parsedate_to_datetime
+from functools import lru_cache
+
+from contacts_core import parse_name
+
+# Entries kept per cache. Headers are the largest entries (a To line can
+# list dozens of addresses), so that cache is the smallest; together they
+# stay within a few tens of MB per process.
+HEADER_CACHE_SIZE = 8192
+MAILBOX_CACHE_SIZE = 32768
+
+# Characters with a meaning of their own in an address list besides quoted
+# strings (comments, groups, domain literals, quoted pairs, and CR, which
+# ends a quoted string). Headers containing any of them are always parsed
+# whole.
+SPECIALS = re.compile(r'[()\\:;\[\]\r]')
+
+# The common forms of a single address item: a bare address, or one in angle
+# brackets after a quoted or plain display name. Atoms exclude every
+# character getaddresses treats specially (and any whitespace), so a match
+# means it would return exactly (name, address) for the item.
+ATOM = r'[^\s()<>@,:;."\[\]\\]+'
+ADDRESS = rf"{ATOM}(?:\.{ATOM})*@{ATOM}(?:\.{ATOM})*"
+PHRASE_ATOM = r'[^\s()<>@,:;"\[\]\\]+'
+MAILBOX = re.compile(rf'(?:"([^"\\\r]*)"|({PHRASE_ATOM}(?:[ \t\r\n]+{PHRASE_ATOM})*))?[ \t\r\n]*<({ADDRESS})>|({ADDRESS})')
+
+MONTHS = {name: number for number, name in enumerate(
+    ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), 1)}
+
+# "[Day,] D Mon YYYY HH:MM[:SS] +HHMM [(comment)]"
+# (two-digit and zero-padded years are left to parsedate_to_datetime, which
+# maps them into 1950-2049)
+DATE = re.compile(r"\s*(?:[A-Za-z]{3},\s*)?(\d{1,2})\s+([A-Za-z]{3})\s+([1-9]\d{3})\s+"
+                  r"(\d{1,2}):(\d{2})(?::(\d{2}))?\s+([+-])(\d{2})(\d{2})\s*(?:\([^()]*\)\s*)?$", re.ASCII)
+
+
+def split_addresses(value):
+    """
+    The items of a simple address list (split on the commas outside quoted
+    display names), or None when the value needs the full parser.
+    """
+    if SPECIALS.search(value):
+        return None
+    if '"' not in value:
+        items = value.split(",")
+    else:
+        # Odd pieces of the split on '"' are the quoted strings
+        pieces = value.split('"')
+        if len(pieces) % 2 == 0:
+            return None
+        items = [""]
+        for i, piece in enumerate(pieces):
+            if i % 2:
+                items[-1] += '"' + piece + '"'
+            else:
+                first, *rest = piece.split(",")
+                items[-1] += first
+                items.extend(rest)
+    for item in items:
+        opening = item.count("<")
+        if opening > 1 or opening != item.count(">"):
+            return None
+    return items
+
+
+def parse_mailbox(item):
+    """
+    getaddresses([item]) for one item of an address list, with the common
+    forms read by a single regular expression.
+    """
+    match = MAILBOX.fullmatch(item)
+    if match is None:
+        return getaddresses([item])
+    quoted, phrase, address, bare = match.groups()
+    if bare is not None:
+        return [("", bare)]
+    if quoted is not None:
+        return [(quoted, address)]
+    # getaddresses joins the words of a plain display name with single spaces
+    return [(" ".join(phrase.split()) if phrase else "", address)]
+
+
+class Normalizer:
+    """
+    Cached From/To normalization for one process. `addresses` returns the
+    same entries the uncached loop over getaddresses produced: each valid
+    address as (email, first_name, last_name, full_name, automated), plus the
+    number of malformed entries skipped.
+    """
+    def __init__(self, rules, stats, header_cache_size=HEADER_CACHE_SIZE,
+                 mailbox_cache_size=MAILBOX_CACHE_SIZE):
+        self.rules = rules
+        self.counters = stats.counters
+        self._header = lru_cache(maxsize=header_cache_size)(self._parse_header)
+        self._mailbox = lru_cache(maxsize=mailbox_cache_size)(self._parse_mailbox)
+
+    def addresses(self, value):
+        # Headers with undecodable bytes come back as email.header.Header
+        # objects, which getaddresses would str() anyway
+        if not isinstance(value, str):
+            value = str(value)
+        self.counters["header_cache_lookups"] += 1
+        return self._header(value)
+
+    def _parse_header(self, value):
+        self.counters["header_cache_misses"] += 1
+        items = split_addresses(value)
+        if items is not None:
+            counters = self.counters
+            entries = []
+            malformed = 0
+            for item in items:
+                counters["mailbox_cache_lookups"] += 1
+                parsed = self._mailbox(item.strip(" \t\r\n"))
+                if parsed is None:
+                    break
+                entry, bad = parsed
+                if entry is not None:
+                    entries.append(entry)
+                malformed += bad
+            else:
+                return tuple(entries), malformed
+
+        entries = []
+        malformed = 0
+        for raw_name, email in getaddresses([value]):
+            entry, bad = self._entry(raw_name, email)
+            if entry is not None:
+                entries.append(entry)
+            malformed += bad
+        return tuple(entries), malformed
+
+    def _parse_mailbox(self, item):
+        # None sends the whole header to the full parser: an item that does
+        # not parse to exactly one address would not split the same way
+        self.counters["mailbox_cache_misses"] += 1
+        pairs = parse_mailbox(item)
+        if len(pairs) != 1:
+            return None
+        return self._entry(*pairs[0])
+
+    def _entry(self, raw_name, email):
+        # Only reached on header and mailbox cache misses, which rarely
+        # repeat a (name, email) pair, so it is not cached itself
+        email = email.lower().strip()
+        if not email or "@" not in email:
+            return None, int(bool(email or raw_name))
+        first_name, last_name, full_name = parse_name(raw_name, email)
+        return (email, first_name, last_name, full_name, self.rules.is_automated(email)), 0
+
+
+def parse_date(value):
+    """
+    A Date header as naive local time, like
+    parsedate_to_datetime(value).astimezone(tz=None).replace(tzinfo=None)
+    (a "-0000" zone is left as it is). Raises what parsedate_to_datetime
+    raises for values it cannot read.
+    """
+    match = DATE.match(value) if isinstance(value, str) else None
+    month = MONTHS.get(match.group(2).lower()) if match else None
+    if month is not None:
+        day, _, year, hour, minute, second, sign, tz_hours, tz_minutes = match.groups()
+        fields = (int(year), month, int(day), int(hour), int(minute), int(second or 0))
+        offset = int(tz_hours) * 3600 + int(tz_minutes) * 60
+        # Offsets of a day or more are rejected by datetime.timezone; invalid
+        # fields and out-of-range times are left to the standard path too,
+        # which raises for them
+        if offset < 86400:
+            try:
+                parsed = datetime(*fields)
+                if sign == "-" and not offset:
+                    return parsed
+                # Local time of the UTC timestamp, as astimezone() computes it
+                timestamp = timegm(fields) - (offset if sign == "+" else -offset)
+                return datetime(*time.localtime(timestamp)[:6])
+            except (ValueError, OverflowError, OSError):
+                pass
+    parsed = parsedate_to_datetime(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(tz=None).replace(tzinfo=None)
+    return parsed
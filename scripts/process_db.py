@@ -1,133 +1,232 @@
 #!/usr/bin/env python3
 
 import argparse
-import csv
+import os
+import sys
+import time
 from datetime import datetime
-from sqlalchemy import create_engine, func, case
-from sqlalchemy.orm import sessionmaker
-from mbox_contact_summary import Base, MboxOccurrence, PERSONAL_DOMAINS
+from contacts_core import MESSAGE_YEAR, connect
+from export_formats import EXTENSIONS, FORMATS, arrow_schema, import_pyarrow, open_writer, ArrowWriter
+from run_stats import Progress, RunStats, profiled
+
+DEFAULT_OUTPUT = "/mnt/data/personal_contacts_export.csv"
+
+# Rows fetched from the cursor, and handed to the writer, at a time while
+# writing the export; columnar formats get bigger batches (row groups)
+FETCH_SIZE = 1000
+COLUMNAR_FETCH_SIZE = 65536
+
+# Columns of the mbox_occurrences dump (--occurrences-dir), and rows per
+# row group in each year's file
+OCCURRENCE_COLUMNS = [
+    ("id", "int64"),
+    ("message_id", "int64"),
+    ("message_date", "timestamp"),
+    ("email", "string"),
+    ("header_context", "string"),
+    ("first_name", "string"),
+    ("last_name", "string"),
+    ("name", "string"),
+    ("marker_bits", "int32"),
+    ("is_listserv", "bool"),
+]
+PARTITION_ROWS = 65536
+
+
+# Build the export as a single query over the contacts summary. Domain
+# frequency (occurrences per domain, yahoogroups.com excluded) is joined in
+# from a grouped subquery and every filter is a WHERE clause on an indexed
+# contacts column. The category is the one stored by recategorize(). Rows
+# come out ordered by email. Returns the SQL and its parameters.
+def export_query(personal_only=False, min_direct=0, min_occurrences=0, recent_date=None):
+    conditions = []
+    params = []
+    if personal_only:
+        conditions.append("c.category = 'personal'")
+    if min_direct > 0:
+        conditions.append("c.direct_count >= ?")
+        params.append(min_direct)
+    if min_occurrences > 0:
+        conditions.append("c.occurrences > ?")
+        params.append(min_occurrences)
+    if recent_date is not None:
+        # Compared against the text the DateTime columns store
+        conditions.append("c.last_date >= ?")
+        params.append(recent_date.isoformat(" ", "microseconds"))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"""
+        SELECT a.email, c.name, c.occurrences, c.first_date, c.last_date, c.category,
+               COALESCE(domain_totals.frequency, 0), c.direct_count
+        FROM contacts c
+        JOIN addresses a ON a.id = c.address_id
+        LEFT OUTER JOIN (
+            SELECT domain, SUM(occurrences) AS frequency FROM contacts
+            WHERE domain != 'yahoogroups.com' GROUP BY domain
+        ) AS domain_totals ON domain_totals.domain = c.domain
+        {where}
+        ORDER BY a.email
+    """
+    return sql, params
+
+
+def parse_date(value):
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+# --recent-date as a datetime; a value that does not parse is reported and
+# the filter dropped
+def parse_recent_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except Exception as e:
+        print(f"Error parsing recent-date: {e}")
+        return None
+
+
+# Contacts are categorized at ingest; databases from before that (or after
+# a rebuild) get the built-in rules here. Only then is contacts_db (and
+# SQLAlchemy) imported.
+def categorize_if_needed(conn, db_path, stats):
+    if conn.execute("SELECT 1 FROM contacts WHERE category IS NULL LIMIT 1").fetchone() is None:
+        return
+    from contacts_db import get_session, recategorize
+    print("Categorizing contacts...", file=sys.stderr)
+    with stats.phase("categorize"):
+        session = get_session(db_path)
+        recategorize(session)
+        session.close()
+
+
+# Write mbox_occurrences, with each row's message date and email joined in,
+# to `directory` as one Parquet (or Arrow) file per year of the message
+# date: <directory>/year=2019/part-0.parquet, Hive-style, with undated
+# messages under year=0. The table is read once in storage order; each
+# chunk is converted to Arrow and split by year, and a year's rows are
+# written as a row group whenever PARTITION_ROWS of them have piled up.
+# Returns the number of rows written.
+def dump_occurrences(conn, directory, fmt, stats, show_progress=True):
+    pa = import_pyarrow()
+    schema = arrow_schema(OCCURRENCE_COLUMNS)
+    # SQLite hands back dates as text and booleans as integers; they are
+    # read as such and cast to the schema's types
+    read_types = [pa.int32()] + [pa.string() if pa.types.is_timestamp(field.type)
+                                 else pa.int8() if pa.types.is_boolean(field.type)
+                                 else field.type for field in schema]
+    cursor = conn.execute(f"""
+        SELECT {MESSAGE_YEAR}, o.id, o.message_id, m.message_date, a.email, o.header_context,
+               o.first_name, o.last_name, o.name, o.marker_bits, m.is_listserv
+        FROM mbox_occurrences o
+        JOIN messages m ON m.id = o.message_id
+        JOIN addresses a ON a.id = o.address_id
+    """)
+    writers = {}
+    pending = {}
+
+    def write(year):
+        writer = writers.get(year)
+        if writer is None:
+            partition = os.path.join(directory, f"year={year}")
+            os.makedirs(partition, exist_ok=True)
+            writer = writers[year] = ArrowWriter(os.path.join(partition, f"part-0{EXTENSIONS[fmt]}"),
+                                                 OCCURRENCE_COLUMNS, kind=fmt)
+        writer.write(pa.Table.from_batches(pending.pop(year)).combine_chunks())
+
+    progress = Progress("Dumping occurrences", unit="rows", enabled=show_progress)
+    while True:
+        with stats.phase("query"):
+            rows = cursor.fetchmany(PARTITION_ROWS)
+        if not rows:
+            break
+        with stats.phase("write"):
+            columns = [pa.array(values, type=read_type) for values, read_type in zip(zip(*rows), read_types)]
+            years = columns[0]
+            batch = pa.RecordBatch.from_arrays(
+                [column.cast(field.type) for column, field in zip(columns[1:], schema)], schema=schema)
+            for year in pa.compute.unique(years).to_pylist():
+                queued = pending.setdefault(year, [])
+                queued.append(batch.filter(pa.compute.equal(years, year)))
+                if sum(len(part) for part in queued) >= PARTITION_ROWS:
+                    write(year)
+        progress.update(progress.position + len(rows), len(rows))
+    with stats.phase("write"):
+        for year in list(pending):
+            write(year)
+        for writer in writers.values():
+            writer.close()
+    progress.close()
+    return progress.items
 
 
 def main():
-    parser = argparse.ArgumentParser(description="Process mbox_occurrences and export personal contacts CSV.")
+    parser = argparse.ArgumentParser(description="Export the contacts in the database as CSV, JSON lines, Parquet or Arrow.")
     parser.add_argument("--db", required=True, help="Path to the SQLite database file")
-    parser.add_argument("--output", default="/mnt/data/personal_contacts_export.csv", help="Path to output CSV file")
+    parser.add_argument("--output", default=None, help=f"Path to the output file (default: {DEFAULT_OUTPUT}, with the extension of --format)")
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="Output format (default: csv); parquet and arrow need pyarrow")
+    parser.add_argument("--occurrences-dir", default=None, help="Also dump mbox_occurrences to this directory as Parquet (Arrow with --format arrow), one partition per year")
     parser.add_argument("--min-occurrences", type=int, default=0, help="Drop contacts with Occurrences <= this threshold (e.g., 2)")
     parser.add_argument("--recent-date", type=str, default=None, help="Drop contacts where the most recent contact is older than this date (YYYY-MM-DD)")
     parser.add_argument("--personal-only", action="store_true", help="Export only personal contacts")
     parser.add_argument("--min-direct", type=int, default=0, help="Drop contacts with Direct Count < this threshold (e.g., 2)")
+    parser.add_argument("--stats-json", default=None, help="Write per-phase timings and counters for the export to this JSON file")
+    parser.add_argument("--profile", default=None, help="Write cProfile stats for the export to this file (view with python -m pstats)")
+    parser.add_argument("--no-progress", action="store_true", help="Don't show the live progress line")
     args = parser.parse_args()
 
+    stats = RunStats()
     DB_PATH = args.db
-    engine = create_engine(f"sqlite:///{DB_PATH}")
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
-    # Calculate domain frequency for all emails in mbox_occurrences, excluding yahoogroups.com
-    all_emails = session.query(MboxOccurrence.email).all()
-    domain_counts = {}
-    for email_tuple in all_emails:
-        email = email_tuple[0].lower()
-        domain = email.split("@")[ -1 ]
-        if domain == "yahoogroups.com":
-            continue
-        domain_counts[domain] = domain_counts.get(domain, 0) + 1
-
-    # Calculate direct marker count for each email
-    direct_results = session.query(
-        MboxOccurrence.email,
-        func.sum(case((MboxOccurrence.markers.ilike("%direct%"), 1), else_=0)).label("direct_count")
-    ).group_by(MboxOccurrence.email).all()
-    direct_dict = {}
-    for row in direct_results:
-        direct_dict[row.email.lower()] = int(row.direct_count or 0)
-
-    # Aggregate mbox occurrences by email
-    results = session.query(
-        MboxOccurrence.email,
-        func.count(MboxOccurrence.id).label("occurrences"),
-        func.min(MboxOccurrence.occurrence_date).label("first_occurrence"),
-        func.max(MboxOccurrence.occurrence_date).label("last_occurrence")
-    ).group_by(MboxOccurrence.email).all()
-
-    rows = []
-    for row in results:
-        email = row.email.lower()
-        occurrences = row.occurrences
-        first_occurrence = row.first_occurrence
-        last_occurrence = row.last_occurrence
-
-        # Determine category based on email domain
-        domain = email.split('@')[-1]
-        category = "personal" if domain in PERSONAL_DOMAINS else "business"
-
-        # Retrieve the name from the record with the earliest occurrence
-        name_record = session.query(MboxOccurrence.name).filter(
-            MboxOccurrence.email == email,
-            MboxOccurrence.occurrence_date == first_occurrence
-        ).first()
-        name = name_record.name if name_record and name_record.name else ""
-
-        # Format dates as strings
-        first_occ_str = first_occurrence.strftime("%Y-%m-%d %H:%M:%S") if first_occurrence else ""
-        last_occ_str = last_occurrence.strftime("%Y-%m-%d %H:%M:%S") if last_occurrence else ""
-
-        # Look up domain frequency and direct marker count
-        domain_frequency = domain_counts.get(domain, 0)
-        direct_count = direct_dict.get(email, 0)
-
-        rows.append({
-            "Email": email,
-            "Name": name,
-            "Occurrences": occurrences,
-            "First Occurrence": first_occ_str,
-            "Last Occurrence": last_occ_str,
-            "Category": category,
-            "Domain Frequency": domain_frequency,
-            "Direct Count": direct_count
-        })
-
-    # Filter rows based on personal category only if specified
-    if args.personal_only:
-        rows = [r for r in rows if r["Category"] == "personal"]
-
-    # Filter by minimum number of direct counts
-    if args.min_direct > 0:
-        rows = [r for r in rows if r["Direct Count"] >= args.min_direct]
-
-    # Filter rows based on min-occurrences if specified
-    if args.min_occurrences > 0:
-        rows = [r for r in rows if r["Occurrences"] > args.min_occurrences]
-
-    # Filter rows based on recent-date if specified
-    if args.recent_date:
-        from datetime import datetime
+    # A plain sqlite3 connection; connect also migrates databases written
+    # with an older schema (through contacts_db and SQLAlchemy)
+    with stats.phase("open"):
         try:
-            cutoff_date = datetime.strptime(args.recent_date, "%Y-%m-%d")
-            def is_recent(r):
-                if not r["Last Occurrence"]:
-                    return False
-                try:
-                    last_date = datetime.strptime(r["Last Occurrence"], "%Y-%m-%d %H:%M:%S")
-                    return last_date >= cutoff_date
-                except Exception:
-                    return False
-            rows = [r for r in rows if is_recent(r)]
-        except Exception as e:
-            print(f"Error parsing recent-date: {e}")
-
-    # Write the CSV file
-    csv_path = args.output
-    with open(csv_path, "w", newline="", encoding="utf-8") as csvfile:
-        fieldnames = ["Email", "Name", "Occurrences", "First Occurrence", "Last Occurrence", "Category", "Domain Frequency", "Direct Count"]
-        with open(args.output, "w", newline="", encoding="utf-8") as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            for r in rows:
-                writer.writerow(r)
-
-    print(f"CSV export complete. File saved to {csv_path}")
+            conn = connect(DB_PATH)
+        except (FileNotFoundError, ValueError) as e:
+            parser.error(str(e))
+    categorize_if_needed(conn, DB_PATH, stats)
+
+    sql, params = export_query(
+        personal_only=args.personal_only,
+        min_direct=args.min_direct,
+        min_occurrences=args.min_occurrences,
+        recent_date=parse_recent_date(args.recent_date)
+    )
+
+    # Write the export in batches as rows come off the cursor. Time spent
+    # waiting on the cursor is charged to "query", formatting and writing
+    # to "write".
+    output_path = args.output or os.path.splitext(DEFAULT_OUTPUT)[0] + EXTENSIONS[args.format]
+    fetch_size = COLUMNAR_FETCH_SIZE if args.format in ("parquet", "arrow") else FETCH_SIZE
+    progress = Progress("Exporting", unit="rows", enabled=not args.no_progress)
+    with profiled(args.profile):
+        writer = open_writer(output_path, args.format)
+        phases = stats.phases
+        cursor = conn.execute(sql, params)
+        batches = iter(lambda: cursor.fetchmany(fetch_size), [])
+        for rows in stats.timed(batches, "query"):
+            started = time.perf_counter()
+            # Dates come back as the text SQLite stores
+            writer.write_batch([(email.lower(), name, occurrences, parse_date(first_date), parse_date(last_date), *rest)
+                                for email, name, occurrences, first_date, last_date, *rest in rows])
+            phases["write"] += time.perf_counter() - started
+            progress.update(progress.position + len(rows), len(rows))
+        writer.close()
+        progress.close()
+        stats.count("rows_exported", progress.items)
+        print(f"{args.format.upper()} export complete. File saved to {output_path}")
+
+        if args.occurrences_dir:
+            fmt = "arrow" if args.format == "arrow" else "parquet"
+            rows = dump_occurrences(conn, args.occurrences_dir, fmt, stats, show_progress=not args.no_progress)
+            stats.count("occurrences_dumped", rows)
+            print(f"Occurrences dumped to {args.occurrences_dir} ({rows} rows)")
+
+    conn.close()
+
+    stats.print_summary()
+    if args.stats_json:
+        stats.write_json(args.stats_json, database=DB_PATH, output=output_path)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
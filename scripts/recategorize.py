@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+import argparse
+import time
+from contacts_db import get_session, recategorize
+from rules import CATEGORIES, load_rules
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-categorize every contact from the features already stored in the database.")
+    parser.add_argument("--db", required=True, help="Path to the SQLite database file")
+    parser.add_argument("--rules", default=None, help="JSON file overriding the built-in categorization rules (see rules.py); kept in the database for later runs")
+    args = parser.parse_args()
+
+    # Without --rules the rules last applied to the database are used again
+    rules = load_rules(args.rules) if args.rules else None
+    session = get_session(args.db)
+
+    started = time.perf_counter()
+    counts, changed = recategorize(session, rules)
+    elapsed = time.perf_counter() - started
+
+    print(f"Categorized {sum(counts.values())} contacts in {elapsed:.1f}s, {changed} changed category")
+    for category in CATEGORIES:
+        print(f"  {category}: {counts.get(category, 0)}")
+    session.close()
+
+if __name__ == "__main__":
+    main()
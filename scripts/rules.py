@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Contact categorization rules.
+
+The built-in rules below can be overridden at runtime with a JSON rules file
+(`--rules`), so changing a rule only needs a `recategorize.py` pass over the
+stored features instead of re-ingesting mail. A rules file may set any of:
+
+    {
+        "personal_domains": ["gmail.com", "fastmail.com"],
+        "listserv_domains": ["googlegroups.com", "lists.example.org"],
+        "listserv_headers": ["list-unsubscribe", "list-id", "precedence"],
+        "automation_keywords": ["noreply", "no-reply", "notifications"],
+        "listserv_ratio": 0.5
+    }
+
+Keys that are left out keep their built-in value. The keys a run applies are
+stored in the database and stay in effect for later runs until another rules
+file replaces them. Domains match by suffix
+("gmail.com" also covers "mail.gmail.com"). Contacts are categorized as:
+
+    personal  domain is a personal domain, or the contact has two-way
+              ("direct") contact with the owner and is not a listserv
+    listserv  domain is a listserv domain, the address matches an
+              automation keyword, or at least `listserv_ratio` of its
+              occurrences are in messages with a listserv header
+    business  everything else
+"""
+import json
+import re
+
+# Define domains and patterns for categorization
+PERSONAL_DOMAINS = {
+    "gmail.com", "yahoo.com", "hotmail.com", "aol.com", "me.com", "icloud.com",
+    "comcast.net", "outlook.com", "msn.com", "live.com", "mac.com",
+    "centurylink.net", "earthlink.net", "frontiernet.net", "drizzle.com",
+    "verizon.net", "yahoo.co.uk", "sbcglobal.net"
+}
+
+LISTSERV_DOMAINS = {"googlegroups.com", "yahoogroups.com"}
+
+LISTSERV_HEADERS = [
+    "list-unsubscribe", "precedence", "x-mailer", "x-list"
+]
+
+AUTOMATION_KEYWORDS = ["noreply", "no-reply", "donotreply", "mailer-daemon"]
+
+# Share of a contact's occurrences that must be in listserv messages for the
+# contact to count as a listserv
+LISTSERV_RATIO = 0.5
+
+CATEGORIES = ("personal", "business", "listserv")
+
+
+class Rules:
+    # The rules file keys these rules were built from (see rules_from_overrides)
+    overrides = {}
+
+    def __init__(self, personal_domains=PERSONAL_DOMAINS, listserv_domains=LISTSERV_DOMAINS,
+                 listserv_headers=LISTSERV_HEADERS, automation_keywords=AUTOMATION_KEYWORDS,
+                 listserv_ratio=LISTSERV_RATIO):
+        self.personal_domains = frozenset(domain.lower() for domain in personal_domains)
+        self.listserv_domains = frozenset(domain.lower() for domain in listserv_domains)
+        self.listserv_headers = frozenset(header.lower() for header in listserv_headers)
+        self.automation_keywords = tuple(keyword.lower() for keyword in automation_keywords)
+        self.listserv_ratio = listserv_ratio
+        # One alternation for all keywords instead of a substring test per keyword
+        self.automation_pattern = re.compile(
+            "|".join(re.escape(keyword) for keyword in self.automation_keywords)) if self.automation_keywords else None
+
+    def is_personal_domain(self, domain):
+        return matches_suffix(domain, self.personal_domains)
+
+    def is_listserv_domain(self, domain):
+        return matches_suffix(domain, self.listserv_domains)
+
+    def is_automated(self, email):
+        return self.automation_pattern is not None and self.automation_pattern.search(email) is not None
+
+    def is_listserv_message(self, header_names):
+        """
+        Whether a message with these (lower-case) header names is a listserv
+        message. `header_names` is an iterable or the comma-separated list
+        stored in header_sets.
+        """
+        if isinstance(header_names, str):
+            header_names = header_names.split(",")
+        return not self.listserv_headers.isdisjoint(header_names)
+
+    def categorize(self, email, domain, occurrences=0, direct_count=0, listserv_count=0):
+        """
+        Category of a single contact; `categorize_frame` applies the same
+        rules to a whole table at once.
+        """
+        listserv = (self.is_listserv_domain(domain) or self.is_automated(email)
+                    or (listserv_count > 0 and listserv_count >= self.listserv_ratio * occurrences))
+        if self.is_personal_domain(domain) or (direct_count > 0 and not listserv):
+            return "personal"
+        return "listserv" if listserv else "business"
+
+    def categorize_frame(self, frame):
+        """
+        Categorize every row of a DataFrame with email, domain, occurrences,
+        direct_count and listserv_count columns. Domain rules are evaluated
+        once per distinct domain and the keyword matcher once per address;
+        everything else is column arithmetic. Returns an array of categories.
+        """
+        import numpy as np
+
+        domains = frame["domain"].fillna("")
+        unique = domains.unique()
+        personal = domains.map(dict(zip(unique, map(self.is_personal_domain, unique)))).to_numpy(bool)
+        listserv = domains.map(dict(zip(unique, map(self.is_listserv_domain, unique)))).to_numpy(bool)
+        if self.automation_pattern is not None:
+            listserv = listserv | frame["email"].str.contains(self.automation_pattern, na=False).to_numpy(bool)
+        listserv_count = frame["listserv_count"].to_numpy()
+        listserv = listserv | ((listserv_count > 0) & (listserv_count >= self.listserv_ratio * frame["occurrences"].to_numpy()))
+        direct = frame["direct_count"].to_numpy() > 0
+        return np.select([personal, direct & ~listserv, listserv], ["personal", "personal", "listserv"], "business")
+
+
+def matches_suffix(domain, suffixes):
+    """
+    Whether `domain` or any parent domain of it is in `suffixes`.
+    """
+    domain = domain.lower()
+    while True:
+        if domain in suffixes:
+            return True
+        dot = domain.find(".")
+        if dot == -1:
+            return False
+        domain = domain[dot + 1:]
+
+
+def rules_from_overrides(overrides, source):
+    """
+    The built-in rules, with the keys in the dict `overrides` replacing the
+    defaults. `source` names where the keys came from in error messages.
+    """
+    if not isinstance(overrides, dict):
+        raise ValueError(f"The {source} must be a JSON object")
+    lists = ("personal_domains", "listserv_domains", "listserv_headers", "automation_keywords")
+    unknown = set(overrides) - set(lists) - {"listserv_ratio"}
+    if unknown:
+        raise ValueError(f"Unknown keys in {source}: {', '.join(sorted(unknown))}")
+    for key in lists:
+        value = overrides.get(key, [])
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            raise ValueError(f"{key} in {source} must be a list of strings")
+    ratio = overrides.get("listserv_ratio", LISTSERV_RATIO)
+    if isinstance(ratio, bool) or not isinstance(ratio, (int, float)) or not 0 <= ratio <= 1:
+        raise ValueError(f"listserv_ratio in {source} must be a number between 0 and 1")
+    rules = Rules(**overrides)
+    rules.overrides = dict(overrides)
+    return rules
+
+
+def load_rules(path=None):
+    """
+    The built-in rules, with any keys set in the JSON file at `path`
+    replacing the defaults.
+    """
+    if not path:
+        return Rules()
+    with open(path, encoding="utf-8") as f:
+        overrides = json.load(f)
+    return rules_from_overrides(overrides, f"rules file {path}")
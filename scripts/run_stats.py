@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Run instrumentation shared by the ingest and export scripts.
+
+`RunStats` accumulates wall time per phase and named counters, and writes
+them as a JSON run report (--stats-json). Counters named
+`<cache>_cache_lookups` and `<cache>_cache_misses` are also reported as the
+cache's hit rate. `Progress` draws a live progress
+line with rate and ETA on stderr. `profiled` wraps a block in cProfile
+(--profile).
+
+Worker processes keep their own RunStats; `drain` snapshots and resets it so
+the snapshot can travel back with a task's results and be `merge`d into the
+main process's totals. Phase times from workers are therefore summed across
+processes and can add up to more than the wall time of the run.
+"""
+import cProfile
+import json
+import platform
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+# Seconds between progress updates on a terminal, and between progress lines
+# when stderr is redirected to a file
+PROGRESS_INTERVAL = 0.5
+PROGRESS_LOG_INTERVAL = 30
+
+
+class RunStats:
+    def __init__(self):
+        self.phases = defaultdict(float)
+        self.counters = Counter()
+        self.files = []
+        self.started = time.perf_counter()
+        self.started_at = datetime.now()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def timed(self, iterable, name):
+        """
+        Yield from `iterable`, charging the time spent producing each item
+        to phase `name`.
+        """
+        phases = self.phases
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                phases[name] += time.perf_counter() - start
+                return
+            phases[name] += time.perf_counter() - start
+            yield item
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def drain(self):
+        """
+        Return the phases and counters as plain dicts and reset them.
+        """
+        snapshot = (dict(self.phases), dict(self.counters))
+        self.phases.clear()
+        self.counters.clear()
+        return snapshot
+
+    def merge(self, snapshot):
+        phases, counters = snapshot
+        for name, seconds in phases.items():
+            self.phases[name] += seconds
+        self.counters.update(counters)
+
+    def cache_hit_rates(self):
+        """
+        Hit rate of every cache counted as `<name>_cache_lookups` and
+        `<name>_cache_misses`, by cache name.
+        """
+        rates = {}
+        for name, lookups in sorted(self.counters.items()):
+            if name.endswith("_cache_lookups") and lookups:
+                cache = name[:-len("_cache_lookups")]
+                rates[cache] = 1 - self.counters[cache + "_cache_misses"] / lookups
+        return rates
+
+    def report(self, **extra):
+        return {
+            "started": self.started_at.isoformat(timespec="seconds"),
+            "elapsed_seconds": round(time.perf_counter() - self.started, 3),
+            "argv": sys.argv,
+            "python": platform.python_version(),
+            "phases": {name: round(seconds, 3) for name, seconds
+                       in sorted(self.phases.items(), key=lambda item: -item[1])},
+            "counters": dict(sorted(self.counters.items())),
+            "cache_hit_rates": {name: round(rate, 4) for name, rate in self.cache_hit_rates().items()},
+            "files": self.files,
+            **extra,
+        }
+
+    def write_json(self, path, **extra):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(**extra), f, indent=2)
+        print(f"Run statistics written to {path}")
+
+    def print_summary(self):
+        elapsed = time.perf_counter() - self.started
+        print(f"Finished in {elapsed:.1f}s")
+        for name, seconds in sorted(self.phases.items(), key=lambda item: -item[1]):
+            print(f"  {name:<16} {seconds:>9.2f}s")
+        for name, value in sorted(self.counters.items()):
+            print(f"  {name:<24} {value:>12,}")
+        rates = self.cache_hit_rates()
+        if rates:
+            print("  cache hit rates: " + ", ".join(f"{name} {rate:.1%}" for name, rate in rates.items()))
+
+
+class Progress:
+    """
+    Live progress for one unit of work. `update` is cheap enough to call per
+    item; the line is redrawn at most every PROGRESS_INTERVAL seconds (or
+    printed every PROGRESS_LOG_INTERVAL seconds when stderr is not a
+    terminal). Positions are bytes unless `unit` says otherwise; the ETA
+    needs a known `total`.
+    """
+    def __init__(self, label, total=None, start=0, unit="bytes", items="messages", stream=None, enabled=True):
+        self.label = label
+        self.total = total
+        self.start = start
+        self.position = start
+        self.unit = unit
+        self.items_label = items
+        self.items = 0
+        self.stream = stream or sys.stderr
+        self.enabled = enabled
+        self.interactive = self.stream.isatty()
+        self.interval = PROGRESS_INTERVAL if self.interactive else PROGRESS_LOG_INTERVAL
+        self.began = time.perf_counter()
+        self.next_update = self.began + self.interval
+        self.drawn = 0
+
+    def update(self, position=None, items=1):
+        self.items += items
+        if position is not None:
+            self.position = position
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if now >= self.next_update:
+            self.next_update = now + self.interval
+            self._draw(self.line(now))
+
+    def line(self, now=None):
+        elapsed = (now or time.perf_counter()) - self.began
+        done = self.position - self.start
+        rate = done / elapsed if elapsed > 0 else 0
+        if self.unit == "bytes":
+            text = format_bytes(self.position)
+            if self.total:
+                text += f" / {format_bytes(self.total)} ({self.position / self.total:.1%})"
+            text += f", {format_bytes(rate)}/s, {self.items:,} {self.items_label}"
+        else:
+            text = f"{self.position:,} {self.unit}, {rate:,.0f} {self.unit}/s"
+        if self.total and rate > 0:
+            text += f", ETA {format_duration(max(self.total - self.position, 0) / rate)}"
+        return f"{self.label}: {text}"
+
+    def _draw(self, line):
+        if self.interactive:
+            self.stream.write("\r" + line.ljust(self.drawn))
+            self.drawn = len(line)
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+
+    def close(self):
+        # Clear the progress line so the next message starts on a clean line
+        if self.drawn:
+            self.stream.write("\r" + " " * self.drawn + "\r")
+            self.stream.flush()
+            self.drawn = 0
+
+
+@contextmanager
+def profiled(path):
+    """
+    Run the block under cProfile and dump the stats to `path` (no-op when
+    `path` is empty). Inspect the output with `python -m pstats <path>` or
+    a viewer such as snakeviz.
+    """
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print(f"Profile written to {path}")
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n:.0f} B"
+        n /= 1024
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
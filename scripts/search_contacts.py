@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import re
+import time
+from datetime import datetime
+from contacts_core import connect
+
+# Matches listed by default (--limit)
+DEFAULT_LIMIT = 20
+
+# Index rows considered per match listed; a person can have a contact row
+# and a VCF row, and ties on rank are broken by occurrences
+CANDIDATES_PER_MATCH = 5
+
+
+# FTS5 query for free text: every word must match the start of a word in the
+# name, the local part of the email or the domain ("ann smi" finds "Anna
+# Smith", "ann@example.org" finds ann.lee@example.org). Words are quoted, so
+# FTS5 operators and punctuation in the input are taken literally.
+def match_expression(text):
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text.lower()))
+
+
+# Look people up in search_index (see contacts_db.py) and return the best
+# `limit` matches, one per email, best first. The index is ranked by bm25;
+# each match gets its occurrence counts and date range from contacts and its
+# name from vcf_contacts when the address is there, from contacts otherwise.
+def search(conn, text, limit=DEFAULT_LIMIT):
+    expression = match_expression(text)
+    if not expression:
+        return []
+    rows = conn.execute("""
+        WITH hits AS (
+            SELECT rowid AS id, rank AS score FROM search_index
+            WHERE search_index MATCH ? ORDER BY rank LIMIT ?
+        ),
+        matched AS (
+            SELECT COALESCE(a.email, v.email) AS email, MIN(h.score) AS score
+            FROM hits h
+            LEFT JOIN addresses a ON h.id > 0 AND a.id = h.id
+            LEFT JOIN vcf_contacts v ON h.id < 0 AND v.id = -h.id
+            GROUP BY 1
+        )
+        SELECT m.email, COALESCE(v.name, c.name), c.occurrences, c.first_date, c.last_date, c.category,
+               v.id IS NOT NULL, m.score
+        FROM matched m
+        LEFT JOIN addresses a ON a.email = m.email
+        LEFT JOIN contacts c ON c.address_id = a.id
+        LEFT JOIN vcf_contacts v ON v.email = m.email
+        ORDER BY m.score, c.occurrences DESC, m.email
+        LIMIT ?
+    """, (expression, limit * CANDIDATES_PER_MATCH, limit))
+    matches = []
+    for email, name, occurrences, first_date, last_date, category, in_vcf, score in rows:
+        matches.append({
+            "email": email,
+            "name": name,
+            "occurrences": occurrences or 0,
+            # Dates come back as the text SQLite stores
+            "first_date": datetime.fromisoformat(first_date) if first_date else None,
+            "last_date": datetime.fromisoformat(last_date) if last_date else None,
+            "category": category,
+            "in_vcf": bool(in_vcf),
+            "score": -score,
+        })
+    return matches
+
+
+def print_matches(matches, elapsed):
+    for match in matches:
+        dates = ""
+        if match["first_date"] is not None:
+            dates = f"{match['first_date']:%Y-%m-%d} .. {match['last_date']:%Y-%m-%d}"
+        print(f"{match['email']:<40} {match['name'] or '':<28} {match['occurrences']:>8,} "
+              f"{dates:<24} {match['category'] or '':<10}{' vcf' if match['in_vcf'] else ''}")
+    print(f"{len(matches)} matches in {elapsed * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the contacts by name, email or domain.")
+    parser.add_argument("query", nargs="+", help="Words to look for; each must start a word of the name, email or domain")
+    parser.add_argument("--db", default="contacts.db", help="SQLite database file (default: contacts.db)")
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT, help=f"Number of matches to list (default: {DEFAULT_LIMIT})")
+    parser.add_argument("--json", action="store_true", help="Print the matches as JSON")
+    args = parser.parse_args()
+
+    try:
+        conn = connect(args.db)
+    except (FileNotFoundError, ValueError) as e:
+        parser.error(str(e))
+    started = time.perf_counter()
+    matches = search(conn, " ".join(args.query), args.limit)
+    elapsed = time.perf_counter() - started
+    conn.close()
+
+    if args.json:
+        print(json.dumps(matches, indent=2, default=datetime.isoformat))
+    else:
+        print_matches(matches, elapsed)
+
+if __name__ == "__main__":
+    main()